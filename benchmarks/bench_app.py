@@ -0,0 +1,476 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    bench_app.py [options]
+    bench_app.py drive <settings_file>
+
+Options:
+    --modes <list>              App modes to benchmark, of wsgi and async [default: wsgi,async]
+    --transports <list>         How to drive each app, of inprocess and http [default: inprocess,http]
+    --requests <n>              Timed requests per run [default: 2000]
+    --warmup <n>                Untimed requests sent before each run [default: 100]
+    --concurrency <n>           Requests in flight at once [default: 8]
+    --mix <mix>                 Weighted query mix [default: hello=3,sum=2,reverse=2,helloperson=1,athenaquery=1,person=1]
+    --athena-latency <ms>       Latency of the stub Athena service [default: 20]
+    --postgres-latency <ms>     Latency of the stub Postgres service [default: 2]
+    --jitter <ms>               Random +/- jitter added to each stub call [default: 0]
+    --workers <n>               Server workers for the http transport [default: 1]
+    --port <port>               Port for the http transport [default: 5077]
+    --seed <n>                  Seed of the request sequence [default: 1]
+    --workdir <dir>             Where to generate the apps (a temporary directory if omitted)
+    --output <file>             Write the results as JSON to this file [default: bench_app_results.json]
+    --compare <file>            Compare the results with a baseline written by an earlier run
+    --tolerance <pct>           Allowed throughput/p95 change before a run counts as a regression [default: 10]
+
+Generates a grip app from config/test.yaml (plus two queries backed by stub Athena
+and Postgres services) in each mode, drives it with a fixed sequence of requests, and
+reports throughput and p50/p95/p99 latency per mode and transport. With --compare, exits
+with status 1 if any run regressed beyond the tolerance or failed more requests than it did
+in the baseline.
+'''
+
+import os, sys
+import json
+import time
+import random
+import shutil
+import socket
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+import importlib
+import asyncio
+import docopt
+import yaml
+
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+APP_MODULE = 'grip_bench_app'
+PROJECT_NAME = 'gripbench'
+
+QUERIES = {
+    'hello': lambda rng: {'query': '{ hello }'},
+    'helloperson': lambda rng: {'query': '{ helloperson { id word person } }'},
+    'sum': lambda rng: {'query': 'query Sum($a: Int!, $b: Int!) { sum(a: $a, b: $b) }',
+                        'variables': {'a': rng.randint(0, 1000), 'b': rng.randint(0, 1000)}},
+    'reverse': lambda rng: {'query': 'query Reverse($word: String!) { reverse(word: $word) }',
+                            'variables': {'word': 'grip%d' % rng.randint(0, 1000)}},
+    'athenaquery': lambda rng: {'query': 'query Athena($sql: String!) { athenaquery(sql: $sql) }',
+                                'variables': {'sql': 'SELECT * FROM t WHERE id = %d' % rng.randint(0, 1000)}},
+    'person': lambda rng: {'query': 'query Person($id: Int!) { person(id: $id) { id word person } }',
+                           'variables': {'id': rng.randint(0, 1000)}}
+}
+
+
+def parse_mix(mix: str) -> dict:
+    weights = {}
+    for entry in mix.split(','):
+        name, _, weight = entry.partition('=')
+        if name not in QUERIES:
+            raise Exception(f'Unknown query "{name}" in --mix; choose from {", ".join(QUERIES)}.')
+        weights[name] = float(weight or 1)
+    return weights
+
+
+def make_requests(mix: dict, count: int, seed: int) -> list:
+    '''Returns (query name, encoded body) pairs drawn from the mix.
+    '''
+    rng = random.Random(seed)
+    names = rng.choices(list(mix), weights=list(mix.values()), k=count)
+    return [(name, json.dumps(QUERIES[name](rng)).encode('utf-8')) for name in names]
+
+
+def percentile(sorted_values: list, fraction: float) -> float:
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def summarize(samples: list, elapsed: float, concurrency: int) -> dict:
+    '''samples are (query name, seconds, ok) triples.
+    '''
+    latencies = sorted(seconds * 1000 for name, seconds, ok in samples)
+    per_query = {}
+    for name, seconds, ok in samples:
+        per_query.setdefault(name, []).append(seconds * 1000)
+
+    return {
+        'requests': len(samples),
+        'errors': sum(1 for name, seconds, ok in samples if not ok),
+        'concurrency': concurrency,
+        'elapsed_s': round(elapsed, 3),
+        'throughput_rps': round(len(samples) / elapsed, 1) if elapsed else 0.0,
+        'latency_ms': {
+            'mean': round(sum(latencies) / len(latencies), 3) if latencies else 0.0,
+            'p50': round(percentile(latencies, 0.50), 3),
+            'p95': round(percentile(latencies, 0.95), 3),
+            'p99': round(percentile(latencies, 0.99), 3),
+            'max': round(latencies[-1], 3) if latencies else 0.0
+        },
+        'queries': {
+            name: {'count': len(values),
+                   'p50_ms': round(percentile(sorted(values), 0.50), 3),
+                   'p95_ms': round(percentile(sorted(values), 0.95), 3)}
+            for name, values in sorted(per_query.items())
+        }
+    }
+
+
+def response_ok(status: int, body: bytes) -> bool:
+    if status != 200:
+        return False
+    try:
+        return not json.loads(body).get('errors')
+    except ValueError:
+        return False
+
+
+def run_threads(send, requests: list, concurrency: int, new_session) -> tuple:
+    '''Sends the requests from concurrency threads, each with its own session.
+    Returns (samples, elapsed seconds).
+    '''
+    samples = []
+    position = iter(range(len(requests)))
+    lock = threading.Lock()
+
+    def worker():
+        session = new_session()
+        while True:
+            with lock:
+                index = next(position, None)
+            if index is None:
+                return
+            name, body = requests[index]
+            start_time = time.perf_counter()
+            try:
+                ok = response_ok(*send(session, body))
+            except Exception:
+                ok = False
+            samples.append((name, time.perf_counter() - start_time, ok))
+
+    threads = [threading.Thread(target=worker) for i in range(concurrency)]
+    start_time = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    return (samples, time.perf_counter() - start_time)
+
+
+def drive_wsgi_inprocess(app, requests: list, concurrency: int) -> tuple:
+    def send(client, body):
+        response = client.post('/graphql', data=body, content_type='application/json')
+        return (response.status_code, response.get_data())
+
+    return run_threads(send, requests, concurrency, app.test_client)
+
+
+async def asgi_post(app, body: bytes) -> tuple:
+    '''Calls the ASGI app directly, without a server or client library in between.
+    '''
+    scope = {
+        'type': 'http',
+        'asgi': {'version': '3.0'},
+        'http_version': '1.1',
+        'method': 'POST',
+        'scheme': 'http',
+        'path': '/graphql',
+        'raw_path': b'/graphql',
+        'query_string': b'',
+        'root_path': '',
+        'headers': [(b'content-type', b'application/json'), (b'content-length', str(len(body)).encode())],
+        'client': ('127.0.0.1', 50000),
+        'server': ('127.0.0.1', 80)
+    }
+    request_messages = [{'type': 'http.request', 'body': body, 'more_body': False}]
+    disconnected = asyncio.get_event_loop().create_future()
+    response = {'status': None, 'body': bytearray()}
+
+    async def receive():
+        if request_messages:
+            return request_messages.pop(0)
+        # the client stays connected until the response is complete
+        return await disconnected
+
+    async def send(message):
+        if message['type'] == 'http.response.start':
+            response['status'] = message['status']
+        elif message['type'] == 'http.response.body':
+            response['body'] += message.get('body', b'')
+
+    await app(scope, receive, send)
+    return (response['status'], bytes(response['body']))
+
+
+def drive_asgi_inprocess(app, requests: list, concurrency: int) -> tuple:
+    samples = []
+    position = iter(range(len(requests)))
+
+    async def worker():
+        for index in position:
+            name, body = requests[index]
+            start_time = time.perf_counter()
+            try:
+                ok = response_ok(*await asgi_post(app, body))
+            except Exception:
+                ok = False
+            samples.append((name, time.perf_counter() - start_time, ok))
+
+    async def run_workers():
+        await asyncio.gather(*[worker() for i in range(concurrency)])
+
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    start_time = time.perf_counter()
+    loop.run_until_complete(run_workers())
+    elapsed = time.perf_counter() - start_time
+    loop.close()
+
+    return (samples, elapsed)
+
+
+def drive_http(port: int, requests: list, concurrency: int) -> tuple:
+    def send(connection, body):
+        connection.request('POST', '/graphql', body=body, headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        return (response.status, response.read())
+
+    return run_threads(send, requests, concurrency, lambda: http.client.HTTPConnection('127.0.0.1', port, timeout=60))
+
+
+def bench_config(args, project_dir: str) -> dict:
+    '''The test.yaml config, pointed at the bench project and its stub services.
+    '''
+    with open(os.path.join(REPO_DIR, 'config', 'test.yaml')) as f:
+        yaml_config = yaml.safe_load(f)
+
+    grip_globals = yaml_config['globals']
+    grip_globals.update({
+        'project_home': project_dir,
+        'service_module': 'bench_services',
+        'resolver_module': 'bench_resolvers',
+        'handler_module': 'bench_handlers',
+        'debug_mode': False,
+        'host': '127.0.0.1',
+        'port': int(args['--port']),
+        'workers': int(args['--workers']),
+        'slow_request_ms': None
+    })
+
+    latency_params = lambda latency: [{'name': 'latency_ms', 'value': float(latency)},
+                                      {'name': 'jitter_ms', 'value': float(args['--jitter'])}]
+    yaml_config['service_objects'].update({
+        'athena': {'class': 'StubAthenaService', 'init_params': latency_params(args['--athena-latency'])},
+        'postgres': {'class': 'StubPostgresService', 'init_params': latency_params(args['--postgres-latency'])}
+    })
+    yaml_config['query_defs'].update({
+        'athenaquery': {'inputs': [{'sql': 'String!'}], 'output': 'String!'},
+        'person': {'inputs': [{'id': 'Int!'}], 'output': 'Greeting!'}
+    })
+    return yaml_config
+
+
+def generate_app(args, workdir: str, mode: str) -> str:
+    '''Generates the app for one mode into its own project directory, returning the config path.
+    '''
+    project_dir = os.path.join(workdir, mode)
+    os.makedirs(project_dir, exist_ok=True)
+    for filename in ('bench_services.py', 'bench_handlers.py'):
+        shutil.copy(os.path.join(BENCH_DIR, filename), project_dir)
+
+    config_file = os.path.join(project_dir, 'bench.yaml')
+    with open(config_file, 'w') as f:
+        yaml.safe_dump(bench_config(args, project_dir), f, sort_keys=False)
+
+    command = [sys.executable, os.path.join(REPO_DIR, 'mkapp'),
+               '--config', config_file, '--project-name', PROJECT_NAME, '--force']
+    if mode == 'async':
+        command.append('--async')
+
+    app_source = subprocess.run(command, cwd=REPO_DIR, env=app_env(project_dir, config_file),
+                                check=True, stdout=subprocess.PIPE).stdout
+    with open(os.path.join(project_dir, f'{APP_MODULE}.py'), 'wb') as f:
+        f.write(app_source)
+
+    return config_file
+
+
+def app_env(project_dir: str, config_file: str) -> dict:
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([project_dir, REPO_DIR, env.get('PYTHONPATH', '')])
+    env['GRIP_HOME'] = project_dir
+    env['GRIP_CONFIG'] = config_file
+    return env
+
+
+def wait_for_port(port: int, timeout: float=30.0):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise Exception(f'The benchmark server did not start listening on port {port}.')
+
+
+def run_inprocess(settings: dict) -> dict:
+    '''Imports the generated app into this process and drives it. Run as a child
+    process ("drive"), so that each app gets a fresh interpreter.
+    '''
+    project_dir = settings['project_dir']
+    os.chdir(project_dir)
+    os.environ.update({'GRIP_HOME': project_dir, 'GRIP_CONFIG': settings['config_file']})
+    sys.path[:0] = [project_dir, REPO_DIR]
+
+    app = importlib.import_module(APP_MODULE).app
+    drive = drive_asgi_inprocess if settings['mode'] == 'async' else drive_wsgi_inprocess
+
+    mix = parse_mix(settings['mix'])
+    drive(app, make_requests(mix, settings['warmup'], settings['seed'] + 1), settings['concurrency'])
+    samples, elapsed = drive(app, make_requests(mix, settings['requests'], settings['seed']), settings['concurrency'])
+    return summarize(samples, elapsed, settings['concurrency'])
+
+
+def run_http(settings: dict) -> dict:
+    project_dir = settings['project_dir']
+    server = subprocess.Popen([sys.executable, f'{APP_MODULE}.py', '--config', settings['config_file']],
+                              cwd=project_dir,
+                              env=app_env(project_dir, settings['config_file']),
+                              stdout=subprocess.DEVNULL,
+                              stderr=subprocess.DEVNULL)
+    try:
+        wait_for_port(settings['port'])
+        mix = parse_mix(settings['mix'])
+        drive_http(settings['port'], make_requests(mix, settings['warmup'], settings['seed'] + 1), settings['concurrency'])
+        samples, elapsed = drive_http(settings['port'],
+                                      make_requests(mix, settings['requests'], settings['seed']),
+                                      settings['concurrency'])
+    finally:
+        server.terminate()
+        server.wait(timeout=60)
+
+    return dict(summarize(samples, elapsed, settings['concurrency']), workers=settings['workers'])
+
+
+def compare(results: dict, baseline: dict, tolerance: float) -> list:
+    '''Returns a description of each run that regressed against the baseline.
+    '''
+    regressions = []
+    for run_name, result in results['runs'].items():
+        previous = baseline.get('runs', {}).get(run_name)
+        if previous is None:
+            continue
+
+        old_rps, new_rps = previous['throughput_rps'], result['throughput_rps']
+        old_p95, new_p95 = previous['latency_ms']['p95'], result['latency_ms']['p95']
+        print(f'{run_name:<20}{old_rps:>12.1f} -> {new_rps:<10.1f}rps {old_p95:>10.2f} -> {new_p95:<8.2f}ms p95'
+              f'{previous["errors"]:>8} -> {result["errors"]:<6}errors')
+
+        if new_rps < old_rps * (1 - tolerance):
+            regressions.append(f'{run_name}: throughput fell from {old_rps} to {new_rps} rps')
+        if new_p95 > old_p95 * (1 + tolerance):
+            regressions.append(f'{run_name}: p95 latency rose from {old_p95} to {new_p95} ms')
+        # failing requests can return faster than working ones, so any new error counts
+        if result['errors'] > previous['errors']:
+            regressions.append(f'{run_name}: errors rose from {previous["errors"]} to {result["errors"]}')
+
+    return regressions
+
+
+def main(args):
+    if args['drive']:
+        with open(args['<settings_file>']) as f:
+            settings = json.load(f)
+        result = run_inprocess(settings)
+        with open(settings['result_file'], 'w') as f:
+            json.dump(result, f)
+        return 0
+
+    workdir = args['--workdir'] or tempfile.mkdtemp(prefix='grip-bench-')
+    modes = args['--modes'].split(',')
+    transports = args['--transports'].split(',')
+    parse_mix(args['--mix'])
+
+    results = {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'mix': args['--mix'],
+            'athena_latency_ms': float(args['--athena-latency']),
+            'postgres_latency_ms': float(args['--postgres-latency']),
+            'jitter_ms': float(args['--jitter'])
+        },
+        'runs': {}
+    }
+
+    for mode in modes:
+        config_file = generate_app(args, workdir, mode)
+        settings = {
+            'mode': mode,
+            'project_dir': os.path.dirname(config_file),
+            'config_file': config_file,
+            'mix': args['--mix'],
+            'requests': int(args['--requests']),
+            'warmup': int(args['--warmup']),
+            'concurrency': int(args['--concurrency']),
+            'seed': int(args['--seed']),
+            'port': int(args['--port']),
+            'workers': int(args['--workers'])
+        }
+
+        for transport in transports:
+            run_name = f'{mode}/{transport}'
+            print(f'running {run_name}...', file=sys.stderr)
+
+            if transport == 'http':
+                result = run_http(settings)
+            else:
+                settings_file = os.path.join(settings['project_dir'], 'drive.json')
+                settings['result_file'] = os.path.join(settings['project_dir'], 'result.json')
+                with open(settings_file, 'w') as f:
+                    json.dump(settings, f)
+                subprocess.run([sys.executable, os.path.abspath(__file__), 'drive', settings_file],
+                               env=app_env(settings['project_dir'], config_file),
+                               stdout=subprocess.DEVNULL,
+                               check=True)
+                with open(settings['result_file']) as f:
+                    result = json.load(f)
+
+            results['runs'][run_name] = result
+
+    print(f'{"run":<20}{"rps":>10}{"p50 ms":>10}{"p95 ms":>10}{"p99 ms":>10}{"errors":>8}')
+    for run_name, result in results['runs'].items():
+        latency = result['latency_ms']
+        print(f'{run_name:<20}{result["throughput_rps"]:>10.1f}{latency["p50"]:>10.2f}'
+              f'{latency["p95"]:>10.2f}{latency["p99"]:>10.2f}{result["errors"]:>8}')
+
+    with open(args['--output'], 'w') as f:
+        json.dump(results, f, indent=2)
+
+    if not args['--workdir']:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    if args['--compare']:
+        with open(args['--compare']) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, float(args['--tolerance']) / 100)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        return 1 if regressions else 0
+
+    return 0
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    sys.exit(main(args))
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    bench_codegen.py [--types <n>] [--queries <n>] [--mutations <n>] [--rounds <n>] [--workdir <dir>]
+
+Options:
+    --types <n>         Object types in the synthetic config [default: 10000]
+    --queries <n>       Queries in the synthetic config [default: 1000]
+    --mutations <n>     Mutations in the synthetic config [default: 200]
+    --rounds <n>        Timed rounds of each in-process measurement [default: 3]
+    --workdir <dir>     Where to generate the project (a temporary directory if omitted)
+
+Times code generation for a large synthetic schema: per-call template rendering with a
+fresh jinja2 environment (the former path) against griputil's shared environment, the
+in-process generators, and mkapp run cold, re-run with nothing changed, and re-run after
+changing one type, reporting which generated files each run rewrote.
+'''
+
+import os, sys
+import time
+import shutil
+import tempfile
+import subprocess
+import docopt
+import jinja2
+import yaml
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import griputil
+from templates import OBJECT_TYPE_DECLARATION_TEMPLATE
+
+PROJECT_NAME = 'gripcodegen'
+GENERATED_FILES = ('app.py', f'{PROJECT_NAME}.graphql', f'{PROJECT_NAME}.graphql.snapshot',
+                   'codegen_resolvers.py', 'codegen_handlers.py')
+
+
+def make_config(num_types: int, num_queries: int, num_mutations: int, project_dir: str) -> dict:
+    '''Types each refer to the one before them (singly and as a list), so the schema
+    carries object-reference fields throughout.
+    '''
+    type_defs = {}
+    for t in range(num_types):
+        fields = {'id': 'ID!', 'name': 'String!', 'size': 'Int'}
+        if t > 0:
+            fields['parent'] = f'Type{t - 1}'
+            fields['siblings'] = {'type': [f'Type{t - 1}'], 'multiplier': 4}
+        type_defs[f'Type{t}'] = fields
+
+    query_defs = {
+        f'query{q}': {'inputs': [{'id': 'ID!'}, {'limit': 'Int'}], 'output': f'Type{q % num_types}'}
+        for q in range(num_queries)
+    }
+    mutation_defs = {
+        f'mutation{m}': {'inputs': [{'id': 'ID!'}, {'name': 'String!'}], 'output': f'Type{m % num_types}!'}
+        for m in range(num_mutations)
+    }
+
+    return {
+        'globals': {
+            'project_home': project_dir,
+            'service_module': 'test_services',
+            'resolver_module': 'codegen_resolvers',
+            'handler_module': 'codegen_handlers',
+            'debug_mode': False,
+            'host': '127.0.0.1',
+            'port': 5050
+        },
+        'service_objects': {},
+        'type_defs': type_defs,
+        'query_defs': query_defs,
+        'mutation_defs': mutation_defs
+    }
+
+
+def mean_time(func, rounds: int) -> float:
+    start = time.perf_counter()
+    for i in range(rounds):
+        func()
+    return (time.perf_counter() - start) / rounds
+
+
+def bench_rendering(yaml_config: dict, rounds: int):
+    type_specs = griputil.load_type_specs(yaml_config)
+
+    def per_call_environment():
+        for typespec in type_specs:
+            jinja2.Environment().from_string(OBJECT_TYPE_DECLARATION_TEMPLATE).render(typespec=typespec)
+
+    def shared_environment():
+        for typespec in type_specs:
+            griputil.generate_object_type_declaration(typespec)
+
+    print(f'rendering {len(type_specs)} object type declarations')
+    print(f'{"":<4}{"per-call environment":<36}{mean_time(per_call_environment, rounds) * 1000:>10.1f} ms')
+    print(f'{"":<4}{"shared environment":<36}{mean_time(shared_environment, rounds) * 1000:>10.1f} ms')
+
+
+def bench_generators(yaml_config: dict, schema_file: str, rounds: int):
+    def generate_all(spec_model=None):
+        griputil.create_gql_schema(yaml_config, spec_model)
+        griputil.generate_resolver_source(yaml_config, spec_model=spec_model)
+        griputil.generate_handler_source(yaml_config, spec_model)
+        griputil.generate_app_source(schema_file, yaml_config, spec_model=spec_model)
+
+    # with no spec model, every generator parses the specs itself
+    per_generator_specs = mean_time(generate_all, rounds)
+    shared_specs = mean_time(lambda: generate_all(griputil.GSpecModel(yaml_config)), rounds)
+
+    print('generating schema, resolver, handler and app sources')
+    print(f'{"":<4}{"specs parsed by each generator":<36}{per_generator_specs * 1000:>10.1f} ms')
+    print(f'{"":<4}{"one spec model for the run":<36}{shared_specs * 1000:>10.1f} ms')
+
+
+def modification_times(project_dir: str) -> dict:
+    times = {}
+    for filename in GENERATED_FILES:
+        filepath = os.path.join(project_dir, filename)
+        times[filename] = os.stat(filepath).st_mtime_ns if os.path.exists(filepath) else None
+    return times
+
+
+def run_mkapp(project_dir: str, config_file: str) -> tuple:
+    '''Returns (seconds, names of the generated files that were written).
+    '''
+    env = dict(os.environ)
+    env['PYTHONPATH'] = os.pathsep.join([project_dir, REPO_DIR, env.get('PYTHONPATH', '')])
+    env['GRIP_HOME'] = project_dir
+    # mkapp imports the generated modules; let their bytecode be cached as it normally would
+    env.pop('PYTHONDONTWRITEBYTECODE', None)
+
+    before = modification_times(project_dir)
+    start = time.perf_counter()
+    subprocess.run([sys.executable, os.path.join(REPO_DIR, 'mkapp'),
+                    '--config', config_file, '--project-name', PROJECT_NAME, '--force',
+                    '--output', os.path.join(project_dir, 'app.py')],
+                   cwd=REPO_DIR, env=env, check=True, stdout=subprocess.DEVNULL)
+    elapsed = time.perf_counter() - start
+
+    after = modification_times(project_dir)
+    return (elapsed, [filename for filename in GENERATED_FILES if after[filename] != before[filename]])
+
+
+def bench_mkapp(yaml_config: dict, project_dir: str):
+    config_file = os.path.join(project_dir, 'codegen.yaml')
+
+    def write_config():
+        with open(config_file, 'w') as f:
+            yaml.safe_dump(yaml_config, f, sort_keys=False)
+
+    write_config()
+    runs = [('cold', run_mkapp(project_dir, config_file))]
+    # the first re-run imports (and byte-compiles) the generated modules the cold run wrote
+    runs.append(('first re-run, nothing changed', run_mkapp(project_dir, config_file)))
+    runs.append(('warm, nothing changed', run_mkapp(project_dir, config_file)))
+
+    yaml_config['type_defs']['Type0']['label'] = 'String'
+    write_config()
+    runs.append(('warm, one type changed', run_mkapp(project_dir, config_file)))
+
+    print('mkapp')
+    for name, (elapsed, written) in runs:
+        print(f'{"":<4}{name:<36}{elapsed * 1000:>10.1f} ms   rewrote {len(written)}: {", ".join(written) or "-"}')
+
+
+def main(args):
+    workdir = args['--workdir'] or tempfile.mkdtemp(prefix='grip-codegen-')
+    project_dir = os.path.abspath(workdir)
+    os.makedirs(project_dir, exist_ok=True)
+    rounds = int(args['--rounds'])
+
+    yaml_config = make_config(int(args['--types']), int(args['--queries']), int(args['--mutations']), project_dir)
+
+    bench_rendering(yaml_config, rounds)
+    bench_generators(yaml_config, os.path.join(project_dir, f'{PROJECT_NAME}.graphql'), rounds)
+    bench_mkapp(yaml_config, project_dir)
+
+    if not args['--workdir']:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -0,0 +1,51 @@
+#!/usr/bin/env python
+
+# handlers for the app generated by bench_app.py
+
+
+def hello_func(input_data, service_registry, **kwargs):
+    return service_registry.lookup('test').test()
+
+
+def helloperson_func(input_data, service_registry, **kwargs):
+    return {'id': 1, 'word': 'hello', 'person': service_registry.lookup('test').test()}
+
+
+def sum_func(input_data, service_registry, **kwargs):
+    return input_data['a'] + input_data['b']
+
+
+def reverse_func(input_data, service_registry, **kwargs):
+    return input_data['word'][::-1]
+
+
+def something_func(input_data, service_registry, **kwargs):
+    return 'something'
+
+
+def athenaquery_func(input_data, service_registry, **kwargs):
+    return service_registry.lookup('athena').athena_to_s3(input_data['sql'])
+
+
+def person_func(input_data, service_registry, **kwargs):
+    return service_registry.lookup('postgres').fetch_person(input_data['id'])
+
+
+def mutx_func(input_data, service_registry, **kwargs):
+    return 'mutx'
+
+
+def m2_func(input_data, service_registry, **kwargs):
+    return 'm2'
+
+
+def Building_residents_batch_func(keys, service_registry, **kwargs):
+    return [[] for key in keys]
+
+
+def Resident_family_batch_func(keys, service_registry, **kwargs):
+    return [[] for key in keys]
+
+
+def Resident_building_batch_func(keys, service_registry, **kwargs):
+    return [None for key in keys]
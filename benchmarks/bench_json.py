@@ -0,0 +1,96 @@
+#!/usr/bin/env python
+
+'''
+Usage:
+    bench_json.py [--buildings <n>] [--residents <n>] [--rounds <n>]
+
+Options:
+    --buildings <n>     Number of buildings in the synthetic result [default: 2000]
+    --residents <n>     Residents per building [default: 20]
+    --rounds <n>        Timed rounds per encoder [default: 10]
+
+Compares response encoding through flask.jsonify (the generated app's former path)
+with gripjson's encoders, reporting mean time and peak traced memory per result.
+'''
+
+import os, sys
+import time
+import tracemalloc
+import docopt
+from flask import Flask, jsonify
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import gripjson
+
+
+def make_result(num_buildings: int, num_residents: int) -> dict:
+    return {
+        'data': {
+            'buildings': [
+                {
+                    'id': str(b),
+                    'buildYear': str(1900 + b % 100),
+                    'residents': [
+                        {'id': f'{b}-{r}', 'name': f'resident {r}', 'age': r, 'family': [{'name': 'relative'}]}
+                        for r in range(num_residents)
+                    ]
+                } for b in range(num_buildings)
+            ]
+        }
+    }
+
+
+def consume(body) -> int:
+    # streamed bodies are consumed chunk by chunk, as a server would send them
+    if isinstance(body, bytes):
+        return len(body)
+    return sum(len(chunk) for chunk in body)
+
+
+def measure(encode, rounds: int):
+    encode()
+    start = time.perf_counter()
+    for i in range(rounds):
+        size = encode()
+    elapsed = (time.perf_counter() - start) / rounds
+
+    tracemalloc.start()
+    encode()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    return (elapsed, peak, size)
+
+
+def main(args):
+    result = make_result(int(args['--buildings']), int(args['--residents']))
+    rounds = int(args['--rounds'])
+
+    app = Flask(__name__)
+    candidates = []
+
+    def flask_jsonify():
+        with app.app_context():
+            return len(jsonify(result).get_data())
+
+    candidates.append(('flask.jsonify', flask_jsonify))
+
+    dumps_functions = [('json', gripjson.stdlib_dumps)]
+    if gripjson.orjson is not None:
+        dumps_functions.append(('orjson', gripjson.orjson_dumps))
+
+    for name, dumps in dumps_functions:
+        whole = gripjson.GJSONEncoder(dumps, stream_threshold=0)
+        streamed = gripjson.GJSONEncoder(dumps)
+        candidates.append((f'gripjson {name}', lambda e=whole: consume(e.encode_body(result))))
+        candidates.append((f'gripjson {name} streamed', lambda e=streamed: consume(e.encode_body(result))))
+
+    print(f'{"encoder":<28}{"mean ms":>10}{"peak MiB":>10}{"bytes":>12}')
+    for name, encode in candidates:
+        elapsed, peak, size = measure(encode, rounds)
+        print(f'{name:<28}{elapsed * 1000:>10.1f}{peak / (1024 * 1024):>10.1f}{size:>12}')
+
+
+if __name__ == '__main__':
+    args = docopt.docopt(__doc__)
+    main(args)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python
+
+import time
+import random
+import hashlib
+
+from test_services import TestService
+
+
+def simulated_latency(latency_ms: float, jitter_ms: float) -> float:
+    return max(0.0, latency_ms + random.uniform(-jitter_ms, jitter_ms)) / 1000
+
+
+class StubAthenaService(object):
+    '''Stands in for AWSAthenaQueryService: each query blocks the calling thread for
+    latency_ms (+/- jitter_ms), as a real start-and-poll cycle would.
+    '''
+    def __init__(self, **kwargs):
+        self.latency_ms = float(kwargs.get('latency_ms') or 0)
+        self.jitter_ms = float(kwargs.get('jitter_ms') or 0)
+
+    def athena_to_s3(self, query: str, max_execution: int=None) -> str:
+        time.sleep(simulated_latency(self.latency_ms, self.jitter_ms))
+        return 's3://bench-bucket/results/%s.csv' % hashlib.sha1(query.encode('utf-8')).hexdigest()
+
+
+class StubPostgresService(object):
+    '''Stands in for PostgreSQLService: each lookup blocks for latency_ms (+/- jitter_ms).
+    '''
+    def __init__(self, **kwargs):
+        self.latency_ms = float(kwargs.get('latency_ms') or 0)
+        self.jitter_ms = float(kwargs.get('jitter_ms') or 0)
+
+    def fetch_person(self, person_id: int) -> dict:
+        time.sleep(simulated_latency(self.latency_ms, self.jitter_ms))
+        return {'id': person_id, 'word': 'hello', 'person': f'person {person_id}'}
@@ -2,8 +2,46 @@
 
 import os, sys
 from typing import Callable
+from collections.abc import Mapping
 import argparse
+import asyncio
+import copy
+import copyreg
+import functools
+import hashlib
+import json
+import logging
+import pickle
+import threading
+import time
+from inspect import isawaitable
+from concurrent.futures import ThreadPoolExecutor
 from snap import snap, common
+import graphql
+from graphql import GraphQLError, GraphQLSchema, parse, validate, execute
+from graphql import build_ast_schema, assert_valid_schema
+from graphql.pyutils import FrozenList
+from ariadne import format_error, make_executable_schema, load_schema_from_path
+from ariadne.enums import set_default_enum_values_on_schema
+
+from gripcache import MISSING, LRUCache, TTLCache, SingleFlight
+from gripcache import PersistedQueryStore, LRUPersistedQueryStore, FilePersistedQueryStore
+from gripcost import GCostAnalyzer, GQueryCost, create_cost_analyzer
+from gripjobs import GJobRunner, JOB_STATUS_QUERY, job_handler, create_job_runner
+import gripmetrics
+from griptrace import GTracer, NULL_SPAN, DEFAULT_TRACING_HEADER, trace_phase, tracing_requested, traced_handler
+from gripslowlog import GSlowRequestLog, create_slow_request_log
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HANDLER_THREADS = 32
+DEFAULT_DOCUMENT_CACHE_SIZE = 256
+DEFAULT_PERSISTED_QUERY_CACHE_SIZE = 1024
+DEFAULT_HANDLER_CACHE_TTL = 60
+DEFAULT_HANDLER_CACHE_ENTRIES = 1024
+DEFAULT_MAX_BATCH_SIZE = 10
+DEFAULT_BATCH_THREADS = 8
 
 
 class UnregisteredQueryHandler(Exception):
@@ -21,16 +59,182 @@ class NoSuchHandlerError(Exception):
         super().__init__(f'No handler {handler_funcname}() exists in module {handler_module_name}')
 
 
-class GRequestForwarder(object):
+class UnregisteredBatchHandler(Exception):
+    def __init__(self, type_name, field_name):
+        super().__init__(f'No batch handler has been registered for the field {type_name}.{field_name}')
+
+
+class GBatchLoadError(Exception):
+    def __init__(self, handler_name, num_keys, num_results):
+        super().__init__(f'Batch handler {handler_name} returned {num_results} results for {num_keys} keys')
+
+
+class GQueryRejected(Exception):
+    def __init__(self, errors: list):
+        super().__init__('; '.join([str(err) for err in errors]))
+        self.errors = errors
+
+
+class GPersistedQueryNotFound(GQueryRejected):
     def __init__(self):
+        super().__init__([GraphQLError('PersistedQueryNotFound',
+                                       extensions={'code': 'PERSISTED_QUERY_NOT_FOUND'})])
+
+
+def handler_cache_key(input_data) -> str:
+    # handler inputs are GraphQL arguments, so they are always JSON-serializable
+    return json.dumps(input_data, sort_keys=True, default=str)
+
+
+def private_copy(result):
+    # each caller of a cached handler gets its own copy, so that one which mutates its
+    # result cannot change what later requests are served; immutable scalars are shared
+    if result is None or isinstance(result, (str, bytes, int, float, bool)):
+        return result
+    return copy.deepcopy(result)
+
+
+def cached_handler(handler: Callable, cache: TTLCache) -> Callable:
+    if asyncio.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def cached_async_handler(input_data, service_registry, **kwargs):
+            key = handler_cache_key(input_data)
+            result = cache.get(key, MISSING)
+            if result is MISSING:
+                result = await handler(input_data, service_registry, **kwargs)
+                cache.put(key, private_copy(result))
+                return result
+            return private_copy(result)
+
+        return cached_async_handler
+
+    @functools.wraps(handler)
+    def cached_sync_handler(input_data, service_registry, **kwargs):
+        key = handler_cache_key(input_data)
+        result = cache.get(key, MISSING)
+        if result is MISSING:
+            result = handler(input_data, service_registry, **kwargs)
+            cache.put(key, private_copy(result))
+            return result
+        return private_copy(result)
+
+    return cached_sync_handler
+
+
+def coalescing_handler(handler: Callable, query_field: str, single_flight: SingleFlight) -> Callable:
+    if asyncio.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def coalescing_async_handler(input_data, service_registry, **kwargs):
+            key = (query_field, handler_cache_key(input_data))
+            return await single_flight.do_async(key, handler, input_data, service_registry, **kwargs)
+
+        return coalescing_async_handler
+
+    @functools.wraps(handler)
+    def coalescing_sync_handler(input_data, service_registry, **kwargs):
+        key = (query_field, handler_cache_key(input_data))
+        return single_flight.do(key, handler, input_data, service_registry, **kwargs)
+
+    return coalescing_sync_handler
+
+
+def invalidating_handler(handler: Callable, caches: list) -> Callable:
+    # caches are cleared only once the mutation has succeeded
+    if asyncio.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def invalidating_async_handler(input_data, service_registry, **kwargs):
+            result = await handler(input_data, service_registry, **kwargs)
+            for cache in caches:
+                cache.clear()
+            return result
+
+        return invalidating_async_handler
+
+    @functools.wraps(handler)
+    def invalidating_sync_handler(input_data, service_registry, **kwargs):
+        result = handler(input_data, service_registry, **kwargs)
+        for cache in caches:
+            cache.clear()
+        return result
+
+    return invalidating_sync_handler
+
+
+class GRequestForwarder(object):
+    def __init__(self, max_handler_threads: int=DEFAULT_HANDLER_THREADS, instrumented: bool=False):
         self.query_handlers = {}
         self.mutation_handlers = {}
+        self.batch_handlers = {}
+        self.query_caches = {}
+        self.single_flight = SingleFlight()
+        self.job_runner = None
+        self.max_handler_threads = max_handler_threads
+        # time the handlers themselves, beneath any cache, coalescing or job wrappers
+        self.instrumented = instrumented
+        self._handler_executor = None
+
+    def timed(self, handler: Callable) -> Callable:
+        handler_name = handler.__name__
+        if self.instrumented:
+            handler = gripmetrics.timed_handler(handler, handler_name)
+        return traced_handler(handler, handler_name)
 
     def register_query_handler(self, query_field:str, handler: Callable):
-        self.query_handlers[query_field] = handler
+        self.query_handlers[query_field] = self.timed(handler)
 
     def register_mutation_handler(self, mutation_field:str, handler: Callable):
-        self.mutation_handlers[mutation_field] = handler
+        self.mutation_handlers[mutation_field] = self.timed(handler)
+
+    def enable_coalescing(self, query_field: str):
+        handler = self.lookup_query_handler(query_field)
+        self.query_handlers[query_field] = coalescing_handler(handler, query_field, self.single_flight)
+
+    def enable_query_cache(self, query_field: str, cache: TTLCache):
+        handler = self.lookup_query_handler(query_field)
+        self.query_caches[query_field] = cache
+        self.query_handlers[query_field] = cached_handler(handler, cache)
+
+    def enable_job_mode(self, query_field: str, job_runner: GJobRunner):
+        '''The query's handler runs in the background, and the query returns its job.
+        Also registers the handler for the jobStatus query.
+        '''
+        handler = self.lookup_query_handler(query_field)
+        self.job_runner = job_runner
+        self.query_handlers[query_field] = job_handler(handler, query_field, job_runner)
+        self.query_handlers[JOB_STATUS_QUERY] = job_runner.job_status
+
+    def invalidate_on_mutation(self, mutation_field: str, query_fields: list):
+        for query_field in query_fields:
+            if query_field not in self.query_caches:
+                raise Exception(f'Mutation {mutation_field} invalidates {query_field}, which is not a cached query. '
+                                f'Give query_defs.{query_field} a cache setting, or remove it from the list.')
+
+        handler = self.lookup_mutation_handler(mutation_field)
+        caches = [self.query_caches[qf] for qf in query_fields]
+        self.mutation_handlers[mutation_field] = invalidating_handler(handler, caches)
+
+    @property
+    def stats(self) -> dict:
+        stats = {
+            'single_flight': self.single_flight.stats,
+            'query_caches': {name: cache.stats for name, cache in self.query_caches.items()}
+        }
+        if self.job_runner:
+            stats['jobs'] = self.job_runner.stats
+        return stats
+
+    def register_batch_handler(self, type_name: str, field_name: str, handler: Callable):
+        self.batch_handlers[(type_name, field_name)] = self.timed(handler)
+
+    def has_batch_handler(self, type_name: str, field_name: str) -> bool:
+        return (type_name, field_name) in self.batch_handlers
+
+    def lookup_batch_handler(self, type_name: str, field_name: str) -> Callable:
+        handler = self.batch_handlers.get((type_name, field_name))
+        if not handler:
+            raise UnregisteredBatchHandler(type_name, field_name)
+
+        return handler
 
     def lookup_query_handler(self, query_field: str) -> Callable:
         handler = self.query_handlers.get(query_field)
@@ -46,6 +250,84 @@ class GRequestForwarder(object):
     
         return handler
 
+    @property
+    def handler_executor(self) -> ThreadPoolExecutor:
+        # created on first use, so that forked workers do not inherit a live pool
+        if self._handler_executor is None:
+            self._handler_executor = ThreadPoolExecutor(max_workers=self.max_handler_threads,
+                                                        thread_name_prefix='grip-handler')
+        return self._handler_executor
+
+    async def invoke_async(self, handler: Callable, input_data, service_registry, **kwargs):
+        '''Run a handler from an async resolver. Coroutine handlers are awaited directly;
+        plain (blocking) handlers are run on the bounded handler thread pool so that
+        they never stall the event loop.
+        '''
+        if asyncio.iscoroutinefunction(handler):
+            return await handler(input_data, service_registry, **kwargs)
+
+        loop = asyncio.get_event_loop()
+        return await loop.run_in_executor(self.handler_executor,
+                                          functools.partial(handler, input_data, service_registry, **kwargs))
+
+
+class GBatchLoader(object):
+    '''Per-request loader which collects the keys requested by sibling field resolvers
+    and hands them to a batch handler in a single call. Each key is loaded at most once
+    per request.
+    '''
+    def __init__(self, handler: Callable, request_context):
+        self.handler = handler
+        self.request_context = request_context
+        self.futures = {}
+        self.pending = []
+
+    def load(self, key):
+        future = self.futures.get(key)
+        if future is not None:
+            return future
+
+        loop = self.request_context.get_event_loop()
+        future = loop.create_future()
+        self.futures[key] = future
+        self.pending.append((key, future))
+
+        # dispatch after the resolvers queued alongside this one have added their keys
+        if len(self.pending) == 1:
+            loop.call_soon(lambda: loop.create_task(self.dispatch()))
+
+        return future
+
+    async def dispatch(self):
+        batch, self.pending = self.pending, []
+        keys = [key for key, future in batch]
+
+        try:
+            forwarder = self.request_context.forwarder
+            results = await forwarder.invoke_async(self.handler,
+                                                   keys,
+                                                   self.request_context.service_registry,
+                                                   request_context=self.request_context)
+            results = list(results)
+            if len(results) != len(keys):
+                raise GBatchLoadError(self.handler.__name__, len(keys), len(results))
+
+        except Exception as err:
+            for key, future in batch:
+                self.futures.pop(key, None)
+                future.set_exception(err)
+            return
+
+        for (key, future), result in zip(batch, results):
+            future.set_result(result)
+
+
+def read_field_value(obj, field_name: str):
+    # same rule as ariadne's default resolver
+    if isinstance(obj, Mapping):
+        return obj.get(field_name)
+    return getattr(obj, field_name, None)
+
 
 class GRequestContext(object):
     def __init__(self,
@@ -56,6 +338,682 @@ class GRequestContext(object):
         self.request = http_request
         self.forwarder = forwarder
         self.service_registry = services
+        self.batch_loaders = {}
+        self.event_loop = None
+        self.tracer = None
+
+    def span(self, name: str):
+        '''Context manager timing part of a handler's work as a custom span of this
+        request's trace. Does nothing unless the request is traced.
+        '''
+        if self.tracer is None:
+            return NULL_SPAN
+        return self.tracer.span(name)
+
+    def get_event_loop(self):
+        # under sync (WSGI) execution, batched fields run on a private loop for this request
+        if self.event_loop is None:
+            self.event_loop = asyncio.new_event_loop()
+        return self.event_loop
+
+    def batch_loader(self, type_name: str, field_name: str) -> GBatchLoader:
+        loader = self.batch_loaders.get((type_name, field_name))
+        if loader is None:
+            handler = self.forwarder.lookup_batch_handler(type_name, field_name)
+            loader = GBatchLoader(handler, self)
+            self.batch_loaders[(type_name, field_name)] = loader
+
+        return loader
+
+    def load_field(self, type_name: str, field_name: str, obj):
+        '''Resolves a nested object field. Data already present on the parent object is returned
+        as-is; otherwise the parent's id is queued on the field's batch loader.
+        '''
+        value = read_field_value(obj, field_name)
+        if value is not None or not self.forwarder.has_batch_handler(type_name, field_name):
+            return value
+
+        key = read_field_value(obj, 'id')
+        if key is None:
+            return None
+
+        return self.batch_loader(type_name, field_name).load(key)
+
+
+def dispose_service(service_object):
+    dispose = getattr(service_object, 'dispose', None)
+    if callable(dispose):
+        try:
+            dispose()
+        except Exception as err:
+            logger.warning(f'error disposing of {service_object.__class__.__name__}: {err}')
+
+
+class GServiceRegistry(common.ServiceObjectRegistry):
+    '''The registry setup() builds from service_objects. It also holds services which can only
+    be parameterized at request time (for instance, from rotating credentials):
+    keyed_service() builds one per distinct parameter set, reuses it on later calls, and
+    disposes of the old instance once the parameters change.
+    '''
+    def __init__(self, service_object_dictionary: dict, service_builders: dict=None):
+        super().__init__(service_object_dictionary)
+        # lazily initialized services are built on their first lookup()
+        self.service_builders = service_builders or {}
+        self.build_times = {}
+        self.keyed_services = {}
+        self._name_locks = {}
+        self._lock = threading.Lock()
+
+    def _name_lock(self, name: str):
+        with self._lock:
+            return self._name_locks.setdefault(name, threading.Lock())
+
+    def lookup(self, service_object_name: str):
+        if service_object_name in self.services or service_object_name not in self.service_builders:
+            return super().lookup(service_object_name)
+
+        with self._name_lock(service_object_name):
+            if service_object_name not in self.services:
+                start_time = time.perf_counter()
+                self.services[service_object_name] = self.service_builders[service_object_name]()
+                self.build_times[service_object_name] = time.perf_counter() - start_time
+                logger.info('initialized service %s in %.3fs' % (service_object_name,
+                                                                  self.build_times[service_object_name]))
+
+        return self.services[service_object_name]
+
+    def keyed_service(self, name: str, factory: Callable, **params):
+        # only a hash of the parameters is kept, since they are often credentials
+        fingerprint = hashlib.sha256(json.dumps(params, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+        entry = self.keyed_services.get(name)
+        if entry is not None and entry[0] == fingerprint:
+            return entry[1]
+
+        with self._name_lock(name):
+            entry = self.keyed_services.get(name)
+            if entry is not None and entry[0] == fingerprint:
+                return entry[1]
+
+            service_object = factory(**params)
+            self.keyed_services[name] = (fingerprint, service_object)
+
+        if entry is not None:
+            logger.info(f'parameters for service {name} have changed; disposing of the previous instance')
+            dispose_service(entry[1])
+
+        return service_object
+
+    def after_fork(self):
+        '''Called in each pre-forked worker before it serves. Services holding connections
+        opened in the parent (such as pooled database connections) implement after_fork()
+        to drop them, so that workers never share a socket.
+        '''
+        services = list(self.services.values()) + [entry[1] for entry in self.keyed_services.values()]
+        for service in services:
+            after_fork = getattr(service, 'after_fork', None)
+            if callable(after_fork):
+                after_fork()
+
+    @property
+    def stats(self) -> dict:
+        '''Stats of every built service (including keyed services) which reports any.
+        '''
+        services = dict(self.services)
+        services.update({name: entry[1] for name, entry in self.keyed_services.items()})
+        return {name: service.stats for name, service in services.items() if hasattr(service, 'stats')}
+
+
+class GAsyncRuntime(object):
+    '''Stands in for the Flask runtime object when a grip app is served over ASGI,
+    so that setup() can initialize both kinds of app the same way.
+    '''
+    def __init__(self, startup_mode: str):
+        self.config = {'startup_mode': startup_mode}
+        self.debug = False
+        self.instance_path = os.getcwd()
+
+
+class GDocumentCache(object):
+    '''LRU cache of parsed-and-validated query documents (and their costs), keyed on the
+    query text and operation name, so that hot operations skip straight to execution.
+    '''
+    def __init__(self,
+                 schema: GraphQLSchema,
+                 max_size: int=DEFAULT_DOCUMENT_CACHE_SIZE,
+                 cost_analyzer: GCostAnalyzer=None):
+        self.schema = schema
+        self.cache = LRUCache(max_size)
+        self.cost_analyzer = cost_analyzer
+
+    def lookup(self, query: str, operation_name: str=None, tracer: GTracer=None):
+        '''Returns a (document, errors, cost) triple. The errors list is empty when the query is valid.
+        '''
+        key = (query, operation_name)
+        entry = self.cache.get(key)
+        if entry is None:
+            entry = parse_and_analyze(self.schema, query, operation_name, self.cost_analyzer, tracer)
+            self.cache.put(key, entry)
+
+        return entry
+
+    @property
+    def stats(self) -> dict:
+        return self.cache.stats
+
+
+def parse_and_validate(schema: GraphQLSchema, query: str, tracer: GTracer=None):
+    try:
+        with trace_phase(tracer, 'parsing'):
+            document = parse(query)
+    except GraphQLError as err:
+        return (None, [err])
+
+    with trace_phase(tracer, 'validation'):
+        return (document, validate(schema, document))
+
+
+def parse_and_analyze(schema: GraphQLSchema,
+                      query: str,
+                      operation_name: str=None,
+                      cost_analyzer: GCostAnalyzer=None,
+                      tracer: GTracer=None):
+    '''Like parse_and_validate(), but also returns the cost of valid documents
+    (or None when there is no analyzer).
+    '''
+    document, errors = parse_and_validate(schema, query, tracer)
+    cost = None
+    if cost_analyzer and not errors:
+        cost = cost_analyzer.analyze(document, operation_name)
+
+    return (document, errors, cost)
+
+
+def read_operation_data(data):
+    if not isinstance(data, dict):
+        raise GraphQLError('Operation data should be a JSON object')
+
+    query = data.get('query')
+    if not isinstance(query, str):
+        raise GraphQLError('The query must be a string.')
+
+    variables = data.get('variables')
+    if variables is not None and not isinstance(variables, dict):
+        raise GraphQLError('Query variables must be a null or an object.')
+
+    operation_name = data.get('operationName')
+    if operation_name is not None and not isinstance(operation_name, str):
+        raise GraphQLError('"%s" is not a valid operation name.' % operation_name)
+
+    return (query, variables, operation_name)
+
+
+def read_persisted_query_hash(data):
+    '''Returns the sha256 hash from an APQ request's persistedQuery extension, or None.
+    '''
+    if not isinstance(data, dict):
+        return None
+
+    extensions = data.get('extensions')
+    if not isinstance(extensions, dict) or not extensions.get('persistedQuery'):
+        return None
+
+    persisted_query = extensions['persistedQuery']
+    if not isinstance(persisted_query, dict):
+        raise GraphQLError('persistedQuery must be an object.')
+
+    if persisted_query.get('version', 1) != 1:
+        raise GraphQLError('Unsupported persisted query version.',
+                           extensions={'code': 'PERSISTED_QUERY_VERSION_NOT_SUPPORTED'})
+
+    query_hash = persisted_query.get('sha256Hash')
+    if not isinstance(query_hash, str):
+        raise GraphQLError('persistedQuery must carry a sha256Hash.')
+
+    return query_hash.lower()
+
+
+class GQueryExecutor(object):
+    '''Executes GraphQL operations for the generated app's /graphql route.
+    Returns the same (success, result) pair as ariadne's graphql_sync().
+    '''
+    def __init__(self,
+                 schema: GraphQLSchema,
+                 document_cache: GDocumentCache=None,
+                 persisted_queries: PersistedQueryStore=None,
+                 cost_analyzer: GCostAnalyzer=None,
+                 report_query_cost: bool=False,
+                 max_batch_size: int=DEFAULT_MAX_BATCH_SIZE,
+                 batch_threads: int=DEFAULT_BATCH_THREADS,
+                 tracing_header: str=DEFAULT_TRACING_HEADER,
+                 trace_all: bool=False,
+                 slow_log: GSlowRequestLog=None,
+                 debug: bool=False):
+        self.schema = schema
+        self.document_cache = document_cache
+        self.persisted_queries = persisted_queries
+        self.cost_analyzer = cost_analyzer
+        self.report_query_cost = report_query_cost
+        self.max_batch_size = max_batch_size
+        self.batch_threads = batch_threads
+        self.tracing_header = tracing_header
+        self.trace_all = trace_all
+        self.slow_log = slow_log
+        self.debug = debug
+        self._batch_executor = None
+
+    @property
+    def batch_executor(self) -> ThreadPoolExecutor:
+        # created on first use, so that forked workers do not inherit a live pool
+        if self._batch_executor is None:
+            self._batch_executor = ThreadPoolExecutor(max_workers=self.batch_threads,
+                                                      thread_name_prefix='grip-batch')
+        return self._batch_executor
+
+    def resolve_persisted_query(self, data, query_hash: str):
+        if self.persisted_queries is None:
+            raise GraphQLError('PersistedQueryNotSupported',
+                               extensions={'code': 'PERSISTED_QUERY_NOT_SUPPORTED'})
+
+        if data.get('query') is None:
+            query = self.persisted_queries.get(query_hash)
+            if query is None:
+                raise GPersistedQueryNotFound()
+            return dict(data, query=query)
+
+        if not isinstance(data['query'], str) or \
+                hashlib.sha256(data['query'].encode('utf-8')).hexdigest() != query_hash:
+            raise GraphQLError('provided sha does not match query',
+                               extensions={'code': 'PERSISTED_QUERY_HASH_MISMATCH'})
+        return data
+
+    def start_tracing(self, context_value) -> GTracer:
+        '''Attaches a tracer to the request context if this request is to be traced:
+        always with globals.trace_all_requests set, otherwise when the client sends the
+        tracing header or the request is sampled for a breakdown in the slow-request log.
+        '''
+        if not isinstance(context_value, GRequestContext):
+            return None
+
+        reported = self.trace_all or tracing_requested(context_value.request, self.tracing_header)
+        if not (reported or (self.slow_log is not None and self.slow_log.sample())):
+            return None
+
+        context_value.tracer = GTracer(reported)
+        return context_value.tracer
+
+    def prepare(self, data, tracer: GTracer=None):
+        query_hash = read_persisted_query_hash(data)
+        if query_hash:
+            data = self.resolve_persisted_query(data, query_hash)
+
+        query, variables, operation_name = read_operation_data(data)
+
+        if self.document_cache:
+            document, errors, cost = self.document_cache.lookup(query, operation_name, tracer)
+        else:
+            document, errors, cost = parse_and_analyze(self.schema, query, operation_name, self.cost_analyzer, tracer)
+
+        if not errors and cost is not None:
+            errors = self.cost_analyzer.check(cost)
+
+        if errors:
+            raise GQueryRejected(errors)
+
+        # only valid documents are registered under their hash
+        if query_hash:
+            self.persisted_queries.put(query_hash, query)
+
+        return (document, variables, operation_name, cost)
+
+    def error_response(self, errors: list, success: bool=False):
+        if not success:
+            for err in errors:
+                logger.error(str(err), exc_info=err.original_error)
+        return (success, {'errors': [format_error(err, self.debug) for err in errors]})
+
+    def format_result(self, result, cost: GQueryCost=None, tracer: GTracer=None):
+        response = {'data': result.data}
+        if result.errors:
+            for err in result.errors:
+                logger.error(str(err), exc_info=err.original_error)
+            response['errors'] = [format_error(err, self.debug) for err in result.errors]
+
+        if self.report_query_cost and cost is not None:
+            response.setdefault('extensions', {})['cost'] = cost.to_dict()
+
+        if tracer is not None and tracer.reported:
+            response.setdefault('extensions', {})['tracing'] = tracer.to_dict()
+
+        return (True, response)
+
+    def finish(self, data, result, start_counter: float, cost: GQueryCost=None, tracer: GTracer=None):
+        if self.slow_log is not None:
+            self.slow_log.record(data, start_counter, tracer, len(result.errors or []))
+        return self.format_result(result, cost, tracer)
+
+    def execute_sync(self, data, context_value):
+        start_counter = time.perf_counter()
+        tracer = self.start_tracing(context_value)
+        try:
+            document, variables, operation_name, cost = self.prepare(data, tracer)
+        except GPersistedQueryNotFound as miss:
+            # APQ clients expect a normal response, and will retry with the full query text
+            return self.error_response(miss.errors, success=True)
+        except GQueryRejected as rejection:
+            return self.error_response(rejection.errors)
+        except GraphQLError as err:
+            return self.error_response([err])
+
+        with trace_phase(tracer, 'execution'):
+            result = execute(self.schema,
+                             document,
+                             context_value=context_value,
+                             variable_values=variables,
+                             operation_name=operation_name,
+                             middleware=[tracer] if tracer else None)
+
+            if isawaitable(result):
+                # batched fields are still pending; finish them on this request's own loop
+                if isinstance(context_value, GRequestContext):
+                    loop = context_value.get_event_loop()
+                else:
+                    loop = asyncio.new_event_loop()
+                try:
+                    result = loop.run_until_complete(result)
+                finally:
+                    loop.close()
+
+        return self.finish(data, result, start_counter, cost, tracer)
+
+    def check_batch(self, operations: list):
+        if not operations:
+            raise GraphQLError('A batch must contain at least one operation.',
+                               extensions={'code': 'BATCH_EMPTY'})
+
+        if len(operations) > self.max_batch_size:
+            raise GraphQLError(f'A batch may contain at most {self.max_batch_size} operations.',
+                               extensions={'code': 'BATCH_TOO_LARGE',
+                                           'batchSize': len(operations),
+                                           'maxBatchSize': self.max_batch_size})
+
+    def format_batch_result(self, operation_results: list):
+        '''Folds each operation's (success, result) pair into a list of results, recording
+        the status its operation would have had on its own under extensions.status.
+        '''
+        results = []
+        for success, result in operation_results:
+            result.setdefault('extensions', {})['status'] = 200 if success else 400
+            results.append(result)
+
+        return (True, results)
+
+    def execute_batch_sync(self, operations: list, context_factory: Callable):
+        '''Executes a batch of operations concurrently on the batch thread pool.
+        Each operation gets its own request context from context_factory().
+        '''
+        try:
+            self.check_batch(operations)
+        except GraphQLError as err:
+            return self.error_response([err])
+
+        futures = [self.batch_executor.submit(self.execute_sync, data, context_factory()) for data in operations]
+        return self.format_batch_result([future.result() for future in futures])
+
+    async def execute_async(self, data, context_value):
+        if isinstance(context_value, GRequestContext):
+            context_value.event_loop = asyncio.get_event_loop()
+
+        start_counter = time.perf_counter()
+        tracer = self.start_tracing(context_value)
+        try:
+            document, variables, operation_name, cost = self.prepare(data, tracer)
+        except GPersistedQueryNotFound as miss:
+            # APQ clients expect a normal response, and will retry with the full query text
+            return self.error_response(miss.errors, success=True)
+        except GQueryRejected as rejection:
+            return self.error_response(rejection.errors)
+        except GraphQLError as err:
+            return self.error_response([err])
+
+        with trace_phase(tracer, 'execution'):
+            result = execute(self.schema,
+                             document,
+                             context_value=context_value,
+                             variable_values=variables,
+                             operation_name=operation_name,
+                             middleware=[tracer] if tracer else None)
+
+            if isawaitable(result):
+                result = await result
+
+        return self.finish(data, result, start_counter, cost, tracer)
+
+    async def execute_batch_async(self, operations: list, context_factory: Callable):
+        '''Executes a batch of operations concurrently on the running loop, at most
+        batch_threads at a time. Each operation gets its own request context.
+        '''
+        try:
+            self.check_batch(operations)
+        except GraphQLError as err:
+            return self.error_response([err])
+
+        semaphore = asyncio.Semaphore(self.batch_threads)
+
+        async def execute_bounded(data):
+            async with semaphore:
+                return await self.execute_async(data, context_factory())
+
+        operation_results = await asyncio.gather(*[execute_bounded(data) for data in operations])
+        return self.format_batch_result(operation_results)
+
+
+def create_query_executor(runtime, schema: GraphQLSchema) -> GQueryExecutor:
+    yaml_config = runtime.config['grip_config']
+    grip_globals = yaml_config['globals']
+    cost_analyzer = create_cost_analyzer(yaml_config, schema)
+
+    cache_size = grip_globals.get('document_cache_size', DEFAULT_DOCUMENT_CACHE_SIZE)
+    document_cache = None
+    if cache_size:
+        document_cache = GDocumentCache(schema, int(cache_size), cost_analyzer)
+
+    persisted_queries = init_persisted_query_store(grip_globals)
+    slow_log = create_slow_request_log(grip_globals)
+
+    if metrics_enabled(grip_globals):
+        if document_cache:
+            gripmetrics.register_stats('grip_document_cache', lambda: document_cache.stats)
+        if persisted_queries:
+            gripmetrics.register_stats('grip_persisted_queries', lambda: persisted_queries.stats)
+        if cost_analyzer:
+            gripmetrics.register_stats('grip_query_cost', lambda: cost_analyzer.stats)
+        if slow_log:
+            gripmetrics.register_stats('grip_slow_requests', lambda: slow_log.stats)
+
+    return GQueryExecutor(schema,
+                          document_cache,
+                          persisted_queries=persisted_queries,
+                          cost_analyzer=cost_analyzer,
+                          report_query_cost=bool(grip_globals.get('report_query_cost')),
+                          max_batch_size=int(grip_globals.get('max_batch_size') or DEFAULT_MAX_BATCH_SIZE),
+                          batch_threads=int(grip_globals.get('batch_threads') or DEFAULT_BATCH_THREADS),
+                          tracing_header=grip_globals.get('tracing_header', DEFAULT_TRACING_HEADER),
+                          trace_all=bool(grip_globals.get('trace_all_requests')),
+                          slow_log=slow_log,
+                          debug=runtime.debug)
+
+
+def metrics_enabled(grip_globals: dict) -> bool:
+    # off unless globals.metrics is set
+    return bool(grip_globals.get('metrics'))
+
+
+def register_runtime_stats(services: GServiceRegistry, forwarder: GRequestForwarder):
+    gripmetrics.register_stats('grip_service', lambda: services.stats, 'service')
+    gripmetrics.register_stats('grip_single_flight', lambda: forwarder.single_flight.stats)
+    gripmetrics.register_stats('grip_query_cache', lambda: forwarder.stats['query_caches'], 'query')
+    gripmetrics.register_stats('grip_jobs', lambda: forwarder.stats.get('jobs'))
+
+
+def init_persisted_query_store(grip_globals: dict) -> PersistedQueryStore:
+    store_type = grip_globals.get('persisted_queries')
+    cache_size = int(grip_globals.get('persisted_query_cache_size', DEFAULT_PERSISTED_QUERY_CACHE_SIZE))
+
+    if not store_type:
+        return None
+    if store_type == 'lru':
+        return LRUPersistedQueryStore(cache_size)
+    if store_type == 'file':
+        store_dir = common.load_config_var(grip_globals.get('persisted_query_dir'))
+        if not store_dir:
+            raise Exception('globals.persisted_query_dir must be set when persisted_queries is "file".')
+        return FilePersistedQueryStore(store_dir, cache_size)
+
+    raise Exception(f'Unsupported persisted_queries setting "{store_type}". Valid settings are "lru" and "file".')
+
+
+# graphql-core's FrozenList refuses the extend() call pickle makes to rebuild a list subclass
+copyreg.pickle(FrozenList, lambda frozen_list: (FrozenList, (list(frozen_list),)))
+
+
+def schema_snapshot_path(schema_file: str) -> str:
+    return f'{schema_file}.snapshot'
+
+
+def schema_fingerprint(schema_text: str, yaml_config: dict) -> str:
+    '''Identifies the inputs a schema snapshot was built from: the SDL, the YAML config
+    and the graphql-core version (which determines the pickled AST classes).
+    '''
+    sha = hashlib.sha256()
+    sha.update(graphql.version.encode())
+    sha.update(schema_text.encode())
+    sha.update(json.dumps(yaml_config, sort_keys=True, default=str).encode())
+    return sha.hexdigest()
+
+
+def read_snapshot_fingerprint(snapshot_file: str) -> str:
+    '''Reads only the fingerprint at the head of a snapshot, without loading its AST.
+    '''
+    try:
+        with open(snapshot_file, 'rb') as f:
+            fingerprint = pickle.load(f)
+    except Exception:
+        return None
+
+    return fingerprint if isinstance(fingerprint, str) else None
+
+
+def write_schema_snapshot(schema_file: str, yaml_config: dict) -> str:
+    '''Parses (and so validates) the SDL in schema_file and saves the AST next to it,
+    preceded by the fingerprint of the inputs. A snapshot which is already current is
+    left as it is. Returns the snapshot path.
+    '''
+    with open(schema_file) as f:
+        schema_text = f.read()
+
+    fingerprint = schema_fingerprint(schema_text, yaml_config)
+    snapshot_file = schema_snapshot_path(schema_file)
+    if read_snapshot_fingerprint(snapshot_file) == fingerprint:
+        return snapshot_file
+
+    document = parse(schema_text, no_location=True)
+    build_ast_schema(document)
+
+    with open(snapshot_file, 'wb') as f:
+        pickle.dump(fingerprint, f, protocol=pickle.HIGHEST_PROTOCOL)
+        pickle.dump(document, f, protocol=pickle.HIGHEST_PROTOCOL)
+
+    return snapshot_file
+
+
+def read_schema_snapshot(schema_file: str, schema_text: str, yaml_config: dict):
+    '''Returns the snapshotted DocumentNode for schema_file, or None if there is no
+    snapshot or it was built from a different schema, config or graphql-core.
+    '''
+    snapshot_file = schema_snapshot_path(schema_file)
+    if not os.path.isfile(snapshot_file):
+        return None
+
+    try:
+        with open(snapshot_file, 'rb') as f:
+            fingerprint = pickle.load(f)
+            if fingerprint != schema_fingerprint(schema_text, yaml_config):
+                logger.info(f'Schema snapshot {snapshot_file} is stale.')
+                return None
+            return pickle.load(f)
+    except Exception as err:
+        logger.warning(f'Unable to read schema snapshot {snapshot_file}: {err}')
+        return None
+
+
+def load_executable_schema(schema_file: str, bindables: list, yaml_config: dict) -> GraphQLSchema:
+    '''Equivalent to make_executable_schema(load_schema_from_path(schema_file), bindables),
+    but starts from the AST snapshot written by mkapp when it is current. The SDL in a
+    current snapshot was validated when it was written, so that step is skipped here.
+    '''
+    with open(schema_file) as f:
+        schema_text = f.read()
+
+    document = read_schema_snapshot(schema_file, schema_text, yaml_config)
+    if document is None:
+        schema = make_executable_schema(load_schema_from_path(schema_file), bindables)
+    else:
+        schema = build_ast_schema(document, assume_valid_sdl=True)
+        for bindable in bindables:
+            bindable.bind_to_schema(schema)
+
+        set_default_enum_values_on_schema(schema)
+        assert_valid_schema(schema)
+
+    if metrics_enabled(yaml_config['globals']):
+        gripmetrics.instrument_schema(schema)
+    return schema
+
+
+def build_service(yaml_config: dict, service_name: str):
+    # snap builds every service in the config it is given, so give it just the one
+    service_config = dict(yaml_config)
+    service_config['service_objects'] = {service_name: yaml_config['service_objects'][service_name]}
+    return snap.initialize_services(service_config)[service_name]
+
+
+def timed_build_service(yaml_config: dict, service_name: str):
+    start_time = time.perf_counter()
+    service_object = build_service(yaml_config, service_name)
+    return (service_object, time.perf_counter() - start_time)
+
+
+def initialize_services(yaml_config: dict) -> GServiceRegistry:
+    '''Builds the registry of service_objects according to globals.service_init:
+    "serial" (the default) builds each service in turn, "parallel" builds them concurrently
+    on a thread pool, and "lazy" defers building each service until its first lookup().
+    '''
+    grip_globals = yaml_config['globals']
+    init_mode = grip_globals.get('service_init') or 'serial'
+    service_names = list(yaml_config.get('service_objects') or [])
+
+    if init_mode == 'lazy':
+        builders = {name: functools.partial(build_service, yaml_config, name) for name in service_names}
+        return GServiceRegistry({}, builders)
+
+    if init_mode == 'parallel' and len(service_names) > 1:
+        max_threads = int(grip_globals.get('service_init_threads') or len(service_names))
+        with ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix='grip-setup') as executor:
+            results = list(executor.map(functools.partial(timed_build_service, yaml_config), service_names))
+
+    elif init_mode in ['serial', 'parallel']:
+        results = [timed_build_service(yaml_config, name) for name in service_names]
+
+    else:
+        raise Exception(f'Unsupported service_init mode "{init_mode}". Valid modes are "serial", "parallel" and "lazy".')
+
+    registry = GServiceRegistry({name: result[0] for name, result in zip(service_names, results)})
+    registry.build_times = {name: result[1] for name, result in zip(service_names, results)}
+    for name in service_names:
+        logger.info('initialized service %s in %.3fs' % (name, registry.build_times[name]))
+
+    return registry
 
 
 def load_grip_config(mode, app):
@@ -89,9 +1047,12 @@ def load_grip_config(mode, app):
 
 def init_request_forwarder(yaml_config):
 
-    forwarder = GRequestForwarder()
+    max_threads = yaml_config['globals'].get('handler_threads') or DEFAULT_HANDLER_THREADS
+    forwarder = GRequestForwarder(max_handler_threads=int(max_threads),
+                                  instrumented=metrics_enabled(yaml_config['globals']))
     handler_module_name = yaml_config['globals']['handler_module']
     handler_module = __import__(handler_module_name)
+    job_runner = None
 
     for query_name in yaml_config['query_defs']:
         handler_funcname = f'{query_name}_func'
@@ -101,9 +1062,65 @@ def init_request_forwarder(yaml_config):
         handler_function = getattr(handler_module, handler_funcname)                
         forwarder.register_query_handler(query_name, handler_function)
 
+        # coalescing goes beneath the cache, so that only cache misses share an execution
+        if yaml_config['query_defs'][query_name].get('coalesce'):
+            forwarder.enable_coalescing(query_name)
+
+        cache_config = yaml_config['query_defs'][query_name].get('cache')
+        if cache_config:
+            ttl = cache_config.get('ttl', DEFAULT_HANDLER_CACHE_TTL)
+            max_entries = cache_config.get('max_entries', DEFAULT_HANDLER_CACHE_ENTRIES)
+            forwarder.enable_query_cache(query_name, TTLCache(int(max_entries), float(ttl)))
+
+        if yaml_config['query_defs'][query_name].get('async'):
+            if job_runner is None:
+                job_runner = create_job_runner(yaml_config['globals'])
+            forwarder.enable_job_mode(query_name, job_runner)
+
+    # mutation handlers are written by hand, so a mutation without one is only an error if it is requested
+    mutation_segment = yaml_config.get('mutation_defs') or {}
+    for mutation_name, mutation_config in mutation_segment.items():
+        handler_funcname = f'{mutation_name}_func'
+        if not hasattr(handler_module, handler_funcname):
+            continue
+
+        forwarder.register_mutation_handler(mutation_name, getattr(handler_module, handler_funcname))
+
+        invalidated_queries = (mutation_config or {}).get('invalidates')
+        if invalidated_queries:
+            forwarder.invalidate_on_mutation(mutation_name, invalidated_queries)
+
+    # batch handlers are optional; nested fields without one resolve from their parent object
+    for type_name, field_name in load_batch_fields(yaml_config):
+        handler_funcname = f'{type_name}_{field_name}_batch_func'
+        if hasattr(handler_module, handler_funcname):
+            forwarder.register_batch_handler(type_name, field_name, getattr(handler_module, handler_funcname))
+
     return forwarder
 
 
+def base_type_name(datatype) -> str:
+    if isinstance(datatype, dict):
+        datatype = datatype['type']
+    if isinstance(datatype, list):
+        datatype = datatype[0]
+    return str(datatype).strip('[]!')
+
+
+def load_batch_fields(yaml_config: dict) -> list:
+    '''Returns (type name, field name) pairs for every type_defs field whose type is itself
+    one of the object types in type_defs.
+    '''
+    type_segment = yaml_config.get('type_defs') or {}
+    batch_fields = []
+    for type_name, field_dict in type_segment.items():
+        for field_name, field_type in field_dict.items():
+            if base_type_name(field_type) in type_segment:
+                batch_fields.append((type_name, field_name))
+
+    return batch_fields
+
+
 def setup(flask_runtime):
     if flask_runtime.config.get('initialized'):
         return flask_runtime
@@ -111,10 +1128,12 @@ def setup(flask_runtime):
     mode = flask_runtime.config.get('startup_mode')
     yaml_config = load_grip_config(mode, flask_runtime)
     flask_runtime.debug = yaml_config['globals'].get('debug_mode', False)
+    flask_runtime.config['grip_config'] = yaml_config
     #configure_logging(yaml_config)
 
-    service_object_tbl = snap.initialize_services(yaml_config)
-    flask_runtime.config['services'] = common.ServiceObjectRegistry(service_object_tbl)
+    flask_runtime.config['services'] = initialize_services(yaml_config)
     flask_runtime.config['forwarder'] = init_request_forwarder(yaml_config)
+    if metrics_enabled(yaml_config['globals']):
+        register_runtime_stats(flask_runtime.config['services'], flask_runtime.config['forwarder'])
     flask_runtime.config['initialized'] = True
     return flask_runtime
\ No newline at end of file
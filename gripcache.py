@@ -0,0 +1,290 @@
+#!/usr/bin/env python
+
+import os
+import re
+import asyncio
+import concurrent.futures
+import tempfile
+import threading
+import time
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+
+
+# distinguishes a cache miss from a cached None
+MISSING = object()
+
+
+class LRUCache(object):
+    '''Thread-safe, size-bounded mapping which evicts the least recently used entry
+    when full. Keeps hit/miss/eviction counters for reporting.
+    '''
+    def __init__(self, max_size: int=256):
+        if max_size < 1:
+            raise ValueError('LRUCache max_size must be at least 1.')
+
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+                self.hits += 1
+                return self._data[key]
+
+            self.misses += 1
+            return default
+
+    def put(self, key, value):
+        with self._lock:
+            if key in self._data:
+                self._data.move_to_end(key)
+            self._data[key] = value
+
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+
+    def remove(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __contains__(self, key):
+        with self._lock:
+            return key in self._data
+
+    def __len__(self):
+        return len(self._data)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'size': len(self._data),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions
+        }
+
+
+class TTLCache(LRUCache):
+    '''LRU cache whose entries also expire a fixed number of seconds after they are stored.
+    '''
+    def __init__(self, max_size: int=256, ttl: float=60, clock=time.monotonic):
+        super().__init__(max_size)
+        self.ttl = ttl
+        self.expirations = 0
+        self._clock = clock
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None:
+                expires_at, value = entry
+                if expires_at > self._clock():
+                    self._data.move_to_end(key)
+                    self.hits += 1
+                    return value
+
+                del self._data[key]
+                self.expirations += 1
+
+            self.misses += 1
+            return default
+
+    def put(self, key, value, ttl: float=None):
+        expires_at = self._clock() + (self.ttl if ttl is None else ttl)
+        super().put(key, (expires_at, value))
+
+    def __contains__(self, key):
+        with self._lock:
+            entry = self._data.get(key)
+            return entry is not None and entry[0] > self._clock()
+
+    @property
+    def stats(self) -> dict:
+        stats = super().stats
+        stats['ttl'] = self.ttl
+        stats['expirations'] = self.expirations
+        return stats
+
+
+class FlightAborted(Exception):
+    def __init__(self, key):
+        super().__init__(f'The call coalesced under key {key!r} was interrupted before it finished')
+
+
+class _Flight(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    '''Coalesces concurrent calls which share a key: the first caller executes, and callers
+    arriving while it runs wait for and share its result (or its exception). If the first
+    caller is cancelled or interrupted instead, the waiting callers raise FlightAborted.
+    '''
+    def __init__(self):
+        self.executions = 0
+        self.coalesced = 0
+        self._flights = {}
+        self._async_flights = {}
+        self._lock = threading.Lock()
+
+    def do(self, key, func, *args, **kwargs):
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._flights[key] = flight
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func(*args, **kwargs)
+            return flight.result
+        except Exception as err:
+            flight.error = err
+            raise
+        except BaseException:
+            flight.error = FlightAborted(key)
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+    async def do_async(self, key, coro_func, *args, **kwargs):
+        # callers can be on different event loops (under WSGI each request thread runs its own),
+        # so the flight is a thread-safe future which every waiter wraps for its own loop
+        with self._lock:
+            future = self._async_flights.get(key)
+            leader = future is None
+            if leader:
+                future = concurrent.futures.Future()
+                # a running future cannot be cancelled, so a waiter giving up leaves it alone
+                future.set_running_or_notify_cancel()
+                self._async_flights[key] = future
+                self.executions += 1
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await coro_func(*args, **kwargs)
+            future.set_result(result)
+            return result
+        except Exception as err:
+            future.set_exception(err)
+            raise
+        except BaseException:
+            # the leader was cancelled; wake the waiters rather than leave them blocked
+            future.set_exception(FlightAborted(key))
+            raise
+        finally:
+            with self._lock:
+                del self._async_flights[key]
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'in_flight': len(self._flights) + len(self._async_flights),
+            'executions': self.executions,
+            'coalesced': self.coalesced
+        }
+
+
+SHA256_HEX = re.compile(r'^[0-9a-f]{64}$')
+
+
+class PersistedQueryStore(ABC):
+    '''Maps the sha256 hash of a query document to its text, for automatic persisted queries.
+    '''
+    @abstractmethod
+    def get(self, query_hash: str):
+        pass
+
+    @abstractmethod
+    def put(self, query_hash: str, query: str):
+        pass
+
+
+class LRUPersistedQueryStore(PersistedQueryStore):
+    def __init__(self, max_size: int=1024):
+        self.cache = LRUCache(max_size)
+
+    def get(self, query_hash: str):
+        return self.cache.get(query_hash)
+
+    def put(self, query_hash: str, query: str):
+        self.cache.put(query_hash, query)
+
+    @property
+    def stats(self) -> dict:
+        return self.cache.stats
+
+
+class FilePersistedQueryStore(PersistedQueryStore):
+    '''Keeps one file per registered hash in a shared directory, so that every worker
+    sees registrations made by any other. Recently used queries are held in memory.
+    '''
+    def __init__(self, directory: str, max_size: int=1024):
+        self.directory = directory
+        self.cache = LRUCache(max_size)
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, query_hash: str) -> str:
+        if not SHA256_HEX.match(query_hash):
+            raise ValueError(f'{query_hash} is not a sha256 hex digest.')
+        return os.path.join(self.directory, f'{query_hash}.graphql')
+
+    def get(self, query_hash: str):
+        query = self.cache.get(query_hash)
+        if query is not None:
+            return query
+
+        try:
+            with open(self._path(query_hash)) as f:
+                query = f.read()
+        except (FileNotFoundError, ValueError):
+            return None
+
+        self.cache.put(query_hash, query)
+        return query
+
+    def put(self, query_hash: str, query: str):
+        filepath = self._path(query_hash)
+        self.cache.put(query_hash, query)
+        if os.path.isfile(filepath):
+            return
+
+        # write-then-rename, so that readers in other workers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            f.write(query)
+        os.replace(tmp_path, filepath)
+
+    @property
+    def stats(self) -> dict:
+        return self.cache.stats
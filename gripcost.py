@@ -0,0 +1,219 @@
+#!/usr/bin/env python
+
+import threading
+from graphql import GraphQLError, GraphQLSchema
+from graphql import DocumentNode, OperationDefinitionNode, FragmentDefinitionNode
+from graphql import FieldNode, FragmentSpreadNode
+from graphql import get_named_type, is_list_type, is_non_null_type, is_composite_type
+
+
+DEFAULT_LIST_MULTIPLIER = 10
+
+
+class GQueryCost(object):
+    '''The static cost of one operation: its deepest field nesting, and the number of
+    field resolutions it can fan out into given the configured costs and list sizes.
+    '''
+    def __init__(self, depth: int, cost: int):
+        self.depth = depth
+        self.cost = cost
+
+    def to_dict(self) -> dict:
+        return {'depth': self.depth, 'cost': self.cost}
+
+
+def is_list_field(field_type) -> bool:
+    if is_non_null_type(field_type):
+        field_type = field_type.of_type
+    return is_list_type(field_type)
+
+
+def select_operation(document: DocumentNode, operation_name: str=None):
+    operations = [d for d in document.definitions if isinstance(d, OperationDefinitionNode)]
+    if operation_name is None:
+        return operations[0] if len(operations) == 1 else None
+
+    for operation in operations:
+        if operation.name and operation.name.value == operation_name:
+            return operation
+    return None
+
+
+class GCostAnalyzer(object):
+    '''Computes the depth and cost of validated documents before they are executed.
+
+    Each field costs its configured cost (by default 1 for root and object-valued fields,
+    0 for scalars) once for every time it can be resolved. A list-valued field multiplies
+    the resolutions of everything beneath it by its multiplier.
+    '''
+    def __init__(self,
+                 schema: GraphQLSchema,
+                 field_costs: dict=None,
+                 default_list_multiplier: int=DEFAULT_LIST_MULTIPLIER,
+                 max_depth: int=None,
+                 max_cost: int=None):
+
+        self.schema = schema
+        self.field_costs = field_costs or {}
+        self.default_list_multiplier = default_list_multiplier
+        self.max_depth = max_depth
+        self.max_cost = max_cost
+        self.analyzed = 0
+        self.rejected = 0
+        self.max_cost_seen = 0
+        self._lock = threading.Lock()
+
+    def field_settings(self, parent_type, field_name: str, field):
+        '''Returns the (cost, multiplier) pair for a field.
+        '''
+        cost, multiplier = self.field_costs.get((parent_type.name, field_name), (None, None))
+        if cost is None:
+            is_root = parent_type in (self.schema.query_type, self.schema.mutation_type)
+            cost = 1 if is_root or is_composite_type(get_named_type(field.type)) else 0
+        if multiplier is None:
+            multiplier = self.default_list_multiplier if is_list_field(field.type) else 1
+
+        return (cost, multiplier)
+
+    def analyze(self, document: DocumentNode, operation_name: str=None) -> GQueryCost:
+        operation = select_operation(document, operation_name)
+        if operation is None:
+            return GQueryCost(0, 0)
+
+        root_type = {
+            'query': self.schema.query_type,
+            'mutation': self.schema.mutation_type,
+            'subscription': self.schema.subscription_type
+        }[operation.operation.value]
+
+        fragments = {d.name.value: d for d in document.definitions if isinstance(d, FragmentDefinitionNode)}
+        cost, depth = self.measure(root_type, operation.selection_set, fragments, 1, 0, ())
+
+        with self._lock:
+            self.analyzed += 1
+            self.max_cost_seen = max(self.max_cost_seen, cost)
+
+        return GQueryCost(depth, cost)
+
+    def measure(self, parent_type, selection_set, fragments: dict, count: int, depth: int, spread_path: tuple):
+        '''Returns the (cost, depth) of a selection set resolved count times at depth.
+        '''
+        total_cost = 0
+        max_depth = depth
+
+        for selection in selection_set.selections:
+            if isinstance(selection, FieldNode):
+                field_name = selection.name.value
+                field = getattr(parent_type, 'fields', {}).get(field_name)
+                if field is None:
+                    # introspection fields such as __typename
+                    continue
+
+                cost, multiplier = self.field_settings(parent_type, field_name, field)
+                total_cost += count * cost
+                max_depth = max(max_depth, depth + 1)
+
+                if selection.selection_set:
+                    sub_cost, sub_depth = self.measure(get_named_type(field.type),
+                                                       selection.selection_set,
+                                                       fragments,
+                                                       count * multiplier,
+                                                       depth + 1,
+                                                       spread_path)
+                    total_cost += sub_cost
+                    max_depth = max(max_depth, sub_depth)
+                continue
+
+            fragment_path = spread_path
+            if isinstance(selection, FragmentSpreadNode):
+                fragment = fragments.get(selection.name.value)
+                if fragment is None or fragment.name.value in spread_path:
+                    continue
+                fragment_path = spread_path + (fragment.name.value,)
+            else:
+                fragment = selection
+
+            fragment_type = parent_type
+            if fragment.type_condition is not None:
+                fragment_type = self.schema.get_type(fragment.type_condition.name.value) or parent_type
+
+            sub_cost, sub_depth = self.measure(fragment_type,
+                                               fragment.selection_set,
+                                               fragments,
+                                               count,
+                                               depth,
+                                               fragment_path)
+            total_cost += sub_cost
+            max_depth = max(max_depth, sub_depth)
+
+        return (total_cost, max_depth)
+
+    def check(self, query_cost: GQueryCost) -> list:
+        '''Returns a list of QUERY_TOO_COMPLEX errors, empty if the query is within budget.
+        '''
+        errors = []
+        if self.max_depth and query_cost.depth > self.max_depth:
+            errors.append(GraphQLError(f'Query depth {query_cost.depth} exceeds the maximum depth of {self.max_depth}.',
+                                       extensions={'code': 'QUERY_TOO_COMPLEX',
+                                                   'depth': query_cost.depth,
+                                                   'maxDepth': self.max_depth}))
+
+        if self.max_cost and query_cost.cost > self.max_cost:
+            errors.append(GraphQLError(f'Query cost {query_cost.cost} exceeds the maximum cost of {self.max_cost}.',
+                                       extensions={'code': 'QUERY_TOO_COMPLEX',
+                                                   'cost': query_cost.cost,
+                                                   'maxCost': self.max_cost}))
+        if errors:
+            with self._lock:
+                self.rejected += 1
+
+        return errors
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'analyzed': self.analyzed,
+            'rejected': self.rejected,
+            'max_cost_seen': self.max_cost_seen,
+            'max_depth': self.max_depth,
+            'max_cost': self.max_cost
+        }
+
+
+def load_field_costs(yaml_config: dict, schema: GraphQLSchema) -> dict:
+    '''Reads per-field cost and multiplier settings from the YAML config. Fields in type_defs
+    declare them by using the long form, e.g. "residents: {type: [Resident], multiplier: 50}";
+    query_defs and mutation_defs entries take cost and multiplier keys directly.
+    '''
+    field_costs = {}
+    for type_name, field_dict in (yaml_config.get('type_defs') or {}).items():
+        for field_name, field_value in field_dict.items():
+            if isinstance(field_value, dict):
+                field_costs[(type_name, field_name)] = (field_value.get('cost'), field_value.get('multiplier'))
+
+    for segment_name, root_type in (('query_defs', schema.query_type), ('mutation_defs', schema.mutation_type)):
+        if root_type is None:
+            continue
+        for field_name, field_config in (yaml_config.get(segment_name) or {}).items():
+            if field_config:
+                field_costs[(root_type.name, field_name)] = (field_config.get('cost'), field_config.get('multiplier'))
+
+    return field_costs
+
+
+def create_cost_analyzer(yaml_config: dict, schema: GraphQLSchema) -> GCostAnalyzer:
+    '''Returns an analyzer if the globals set a depth or cost budget, or ask for query costs
+    to be reported; otherwise None.
+    '''
+    grip_globals = yaml_config['globals']
+    max_depth = grip_globals.get('max_query_depth')
+    max_cost = grip_globals.get('max_query_cost')
+
+    if not (max_depth or max_cost or grip_globals.get('report_query_cost')):
+        return None
+
+    return GCostAnalyzer(schema,
+                         load_field_costs(yaml_config, schema),
+                         int(grip_globals.get('default_list_multiplier') or DEFAULT_LIST_MULTIPLIER),
+                         max_depth=int(max_depth) if max_depth else None,
+                         max_cost=int(max_cost) if max_cost else None)
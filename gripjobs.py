@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+
+import os
+import json
+import uuid
+import time
+import asyncio
+import logging
+import tempfile
+import threading
+from abc import ABC, abstractmethod
+from typing import Callable
+from concurrent.futures import ThreadPoolExecutor
+from snap import common
+
+from gripcache import TTLCache
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_JOB_TTL = 3600
+DEFAULT_JOB_THREADS = 4
+DEFAULT_JOB_STORE_SIZE = 10000
+
+JOB_PENDING = 'pending'
+JOB_RUNNING = 'running'
+JOB_DONE = 'done'
+JOB_FAILED = 'failed'
+
+JOB_STATUS_QUERY = 'jobStatus'
+
+
+class JobStore(ABC):
+    '''Holds job records (plain dicts shaped like the generated JobStatus type) for
+    ttl seconds after they were last updated.
+    '''
+    @abstractmethod
+    def get(self, job_id: str):
+        pass
+
+    @abstractmethod
+    def put(self, job: dict):
+        pass
+
+
+class MemoryJobStore(JobStore):
+    '''Job records held by this process only; with several workers, a client polling for
+    a job must reach the worker that ran it. Use FileJobStore to share jobs between workers.
+    '''
+    def __init__(self, ttl: float=DEFAULT_JOB_TTL, max_size: int=DEFAULT_JOB_STORE_SIZE):
+        self.cache = TTLCache(max_size, ttl)
+
+    def get(self, job_id: str):
+        return self.cache.get(job_id)
+
+    def put(self, job: dict):
+        self.cache.put(job['id'], dict(job))
+
+    @property
+    def stats(self) -> dict:
+        return self.cache.stats
+
+
+class FileJobStore(JobStore):
+    '''Keeps one JSON file per job in a shared directory, so that any worker can answer
+    for a job started by another.
+    '''
+    def __init__(self, directory: str, ttl: float=DEFAULT_JOB_TTL):
+        self.directory = directory
+        self.ttl = ttl
+        self._last_purge = time.time()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, job_id: str) -> str:
+        # job ids are uuid4 hex strings; anything else cannot name a job file
+        if not isinstance(job_id, str) or not job_id.isalnum():
+            raise ValueError(f'{job_id} is not a valid job id.')
+        return os.path.join(self.directory, f'{job_id}.json')
+
+    def get(self, job_id: str):
+        try:
+            filepath = self._path(job_id)
+            if time.time() - os.path.getmtime(filepath) > self.ttl:
+                os.remove(filepath)
+                return None
+            with open(filepath) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, job: dict):
+        # write-then-rename, so that readers in other workers never see a partial file
+        fd, tmp_path = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(job, f)
+        os.replace(tmp_path, self._path(job['id']))
+
+        # expired jobs are removed when read; sweep up the ones nobody asked for now and then
+        if time.time() - self._last_purge > self.ttl:
+            self._last_purge = time.time()
+            self.purge_expired()
+
+    def purge_expired(self):
+        now = time.time()
+        for filename in os.listdir(self.directory):
+            filepath = os.path.join(self.directory, filename)
+            try:
+                if filename.endswith('.json') and now - os.path.getmtime(filepath) > self.ttl:
+                    os.remove(filepath)
+            except FileNotFoundError:
+                pass
+
+
+def run_handler(handler: Callable, input_data, service_registry, **kwargs):
+    if not asyncio.iscoroutinefunction(handler):
+        return handler(input_data, service_registry, **kwargs)
+
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(handler(input_data, service_registry, **kwargs))
+    finally:
+        loop.close()
+
+
+class GJobRunner(object):
+    '''Runs the handlers of queries declared "async: true" on a background thread pool.
+    The query returns its job ({id, status}) at once; the handler's result is recorded,
+    JSON-encoded, in the job store, where the generated jobStatus query reads it.
+    '''
+    def __init__(self, job_store: JobStore, max_threads: int=DEFAULT_JOB_THREADS):
+        self.job_store = job_store
+        self.max_threads = max_threads
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self._lock = threading.Lock()
+        self._executor = None
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        # created on first use, so that forked workers do not inherit a live pool
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_threads,
+                                                thread_name_prefix='grip-job')
+        return self._executor
+
+    def submit(self, query_field: str, handler: Callable, input_data, service_registry, **kwargs) -> dict:
+        job = {
+            'id': uuid.uuid4().hex,
+            'query': query_field,
+            'status': JOB_PENDING,
+            'result': None,
+            'error': None,
+            'submittedAt': time.time(),
+            'finishedAt': None
+        }
+        self.job_store.put(job)
+        with self._lock:
+            self.submitted += 1
+
+        self.executor.submit(self.run, job, handler, input_data, service_registry, **kwargs)
+        return {'id': job['id'], 'status': job['status']}
+
+    def run(self, job: dict, handler: Callable, input_data, service_registry, **kwargs):
+        self.job_store.put(dict(job, status=JOB_RUNNING))
+        try:
+            result = run_handler(handler, input_data, service_registry, **kwargs)
+            job = dict(job, status=JOB_DONE, result=json.dumps(result, default=str))
+            with self._lock:
+                self.completed += 1
+        except Exception as err:
+            logger.exception(f'job {job["id"]} for query {job["query"]} failed')
+            job = dict(job, status=JOB_FAILED, error=str(err))
+            with self._lock:
+                self.failed += 1
+
+        job['finishedAt'] = time.time()
+        self.job_store.put(job)
+
+    def job_status(self, input_data, service_registry, **kwargs):
+        '''Handler for the generated jobStatus(id) query.
+        '''
+        return self.job_store.get(input_data['id'])
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'submitted': self.submitted,
+            'completed': self.completed,
+            'failed': self.failed
+        }
+
+
+def job_handler(handler: Callable, query_field: str, job_runner: GJobRunner) -> Callable:
+    def submit_job(input_data, service_registry, **kwargs):
+        # the job outlives its request, so it is not traced as part of it
+        kwargs.pop('request_context', None)
+        return job_runner.submit(query_field, handler, input_data, service_registry, **kwargs)
+
+    return submit_job
+
+
+def create_job_runner(grip_globals: dict) -> GJobRunner:
+    ttl = float(grip_globals.get('job_ttl') or DEFAULT_JOB_TTL)
+    store_dir = common.load_config_var(grip_globals.get('job_store_dir'))
+
+    if store_dir:
+        job_store = FileJobStore(store_dir, ttl)
+    else:
+        job_store = MemoryJobStore(ttl, int(grip_globals.get('job_store_size') or DEFAULT_JOB_STORE_SIZE))
+
+    return GJobRunner(job_store, int(grip_globals.get('job_threads') or DEFAULT_JOB_THREADS))
@@ -0,0 +1,162 @@
+#!/usr/bin/env python
+
+import json
+import importlib
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+
+DEFAULT_STREAM_THRESHOLD = 1024 * 1024
+DEFAULT_STREAM_CHUNK_SIZE = 64 * 1024
+DEFAULT_STREAM_DEPTH = 3
+# lists longer than this are sized by encoding SIZE_SAMPLE_COUNT of their elements
+LONG_LIST_LENGTH = 128
+SIZE_SAMPLE_COUNT = 8
+
+
+STDLIB_ENCODER = json.JSONEncoder(separators=(',', ':'), default=str)
+
+
+def stdlib_dumps(obj) -> bytes:
+    return STDLIB_ENCODER.encode(obj).encode('utf-8')
+
+
+def orjson_dumps(obj) -> bytes:
+    try:
+        return orjson.dumps(obj, default=str, option=orjson.OPT_NON_STR_KEYS)
+    except TypeError:
+        # e.g. integers wider than 64 bits, which the stdlib encoder handles
+        return stdlib_dumps(obj)
+
+
+def load_dumps_function(encoder_name: str):
+    '''Resolves the globals.json_encoder setting: "auto" (orjson when installed), "orjson",
+    "json", or the dotted path of a function taking an object and returning str or bytes.
+    '''
+    if encoder_name in (None, 'auto'):
+        return orjson_dumps if orjson is not None else stdlib_dumps
+    if encoder_name == 'orjson':
+        if orjson is None:
+            raise Exception('globals.json_encoder is "orjson", but the orjson package is not installed.')
+        return orjson_dumps
+    if encoder_name == 'json':
+        return stdlib_dumps
+
+    module_name, _, function_name = encoder_name.rpartition('.')
+    if not module_name:
+        raise Exception(f'Unsupported json_encoder setting "{encoder_name}".')
+    return getattr(importlib.import_module(module_name), function_name)
+
+
+class GJSONEncoder(object):
+    '''Encodes response bodies. Results estimated to be well under stream_threshold bytes
+    are encoded in a single call; larger ones are encoded piecewise, and if they do grow
+    past stream_threshold are returned as an iterator of chunks, so that the server can
+    send them chunked without holding the whole body in memory.
+
+    The estimate encodes a few sampled elements of each long list and scales up by its length.
+    While streaming, dicts and lists down to stream_depth are written out piece by piece,
+    and everything below that depth (e.g. each element of a list of objects) is encoded
+    in one call to the underlying dumps function.
+    '''
+    def __init__(self,
+                 dumps=stdlib_dumps,
+                 stream_threshold: int=DEFAULT_STREAM_THRESHOLD,
+                 chunk_size: int=DEFAULT_STREAM_CHUNK_SIZE,
+                 stream_depth: int=DEFAULT_STREAM_DEPTH):
+
+        self.dumps = dumps
+        self.stream_threshold = stream_threshold
+        self.chunk_size = chunk_size
+        self.stream_depth = stream_depth
+
+    def dump_bytes(self, obj) -> bytes:
+        data = self.dumps(obj)
+        return data.encode('utf-8') if isinstance(data, str) else data
+
+    def estimate_size(self, obj, depth: int=0) -> int:
+        '''Estimates the encoded size of the long lists above stream_depth, the only part of
+        a body that piecewise encoding keeps out of memory; everything else counts as nothing.
+        '''
+        if depth >= self.stream_depth:
+            return 0
+
+        if isinstance(obj, dict):
+            return sum(self.estimate_size(value, depth + 1) for value in obj.values())
+
+        if isinstance(obj, (list, tuple)):
+            if len(obj) <= LONG_LIST_LENGTH:
+                return sum(self.estimate_size(value, depth + 1) for value in obj)
+            sample = obj[::len(obj) // SIZE_SAMPLE_COUNT][:SIZE_SAMPLE_COUNT]
+            return sum(len(self.dump_bytes(value)) + 1 for value in sample) * len(obj) // len(sample)
+
+        return 0
+
+    def iter_pieces(self, obj, depth: int=0):
+        if depth >= self.stream_depth:
+            yield self.dump_bytes(obj)
+
+        elif isinstance(obj, dict):
+            yield b'{'
+            for i, (key, value) in enumerate(obj.items()):
+                yield (b',' if i else b'') + self.dump_bytes(str(key)) + b':'
+                yield from self.iter_pieces(value, depth + 1)
+            yield b'}'
+
+        elif isinstance(obj, (list, tuple)):
+            yield b'['
+            for i, value in enumerate(obj):
+                if i:
+                    yield b','
+                yield from self.iter_pieces(value, depth + 1)
+            yield b']'
+
+        else:
+            yield self.dump_bytes(obj)
+
+    def iter_chunks(self, pieces, head: bytearray=None):
+        '''Regroups encoded pieces into chunks of at least chunk_size bytes, after
+        yielding whatever head was already encoded.
+        '''
+        if head:
+            yield bytes(head)
+
+        buffer = bytearray()
+        for piece in pieces:
+            buffer += piece
+            if len(buffer) >= self.chunk_size:
+                yield bytes(buffer)
+                buffer.clear()
+
+        if buffer:
+            yield bytes(buffer)
+
+    def encode_body(self, obj):
+        '''Returns the encoded body as bytes, or as an iterator over chunks of it when it
+        was encoded piecewise and grew past stream_threshold.
+        '''
+        # encoding piecewise costs more than one dumps call, so only bodies which might
+        # reach the threshold pay for it
+        if not self.stream_threshold or self.estimate_size(obj) < self.stream_threshold // 2:
+            return self.dump_bytes(obj)
+
+        # pieces are copied into one compact buffer rather than kept as many small objects
+        pieces = self.iter_pieces(obj)
+        head = bytearray()
+        for piece in pieces:
+            head += piece
+            if len(head) > self.stream_threshold:
+                return self.iter_chunks(pieces, head)
+
+        return bytes(head)
+
+
+def create_json_encoder(grip_globals: dict) -> GJSONEncoder:
+    stream_threshold = grip_globals.get('stream_threshold', DEFAULT_STREAM_THRESHOLD)
+    return GJSONEncoder(load_dumps_function(grip_globals.get('json_encoder')),
+                        stream_threshold=int(stream_threshold or 0),
+                        chunk_size=int(grip_globals.get('stream_chunk_size') or DEFAULT_STREAM_CHUNK_SIZE),
+                        stream_depth=int(grip_globals.get('stream_depth') or DEFAULT_STREAM_DEPTH))
@@ -0,0 +1,263 @@
+#!/usr/bin/env python
+
+import time
+import asyncio
+import bisect
+import functools
+import threading
+from contextlib import contextmanager
+from inspect import isawaitable
+from typing import Callable
+
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# seconds; spans a cached lookup through a slow Athena query
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def escape_label_value(value) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def format_labels(labelnames: tuple, labelvalues: tuple, extra: str=None) -> str:
+    pairs = [f'{name}="{escape_label_value(value)}"' for name, value in zip(labelnames, labelvalues)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def format_value(value) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter(object):
+    def __init__(self, name: str, documentation: str, labelnames: tuple=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float=1, *labelvalues):
+        with self._lock:
+            self.values[labelvalues] = self.values.get(labelvalues, 0) + amount
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            values = list(self.values.items())
+        for labelvalues, value in values:
+            lines.append(f'{self.name}{format_labels(self.labelnames, labelvalues)} {format_value(value)}')
+        return lines
+
+
+class Histogram(object):
+    '''Cumulative-bucket histogram in the Prometheus style. Each labelled series costs one
+    bisect and a few additions per observation.
+    '''
+    def __init__(self, name: str, documentation: str, labelnames: tuple=(), buckets: tuple=DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, *labelvalues):
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            series = self.series.get(labelvalues)
+            if series is None:
+                # per-bucket counts (the last is +Inf), then the sum
+                series = [0] * (len(self.buckets) + 1) + [0.0]
+                self.series[labelvalues] = series
+            series[index] += 1
+            series[-1] += value
+
+    @contextmanager
+    def time(self, *labelvalues):
+        start_time = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start_time, *labelvalues)
+
+    def render(self) -> list:
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            all_series = [(labelvalues, list(series)) for labelvalues, series in self.series.items()]
+
+        for labelvalues, series in all_series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = 'le="%s"' % format_value(bound)
+                lines.append(f'{self.name}_bucket{format_labels(self.labelnames, labelvalues, le)} {cumulative}')
+            labels = format_labels(self.labelnames, labelvalues)
+            lines.append(f'{self.name}_sum{labels} {format_value(series[-1])}')
+            lines.append(f'{self.name}_count{labels} {cumulative}')
+        return lines
+
+
+# stats keys (or key suffixes, as in result_cache_hits) whose values only ever grow
+COUNTER_STATS = ('hits', 'misses', 'evictions', 'expirations', 'executions', 'coalesced', 'checkouts',
+                 'timeouts', 'discarded', 'refreshes', 'refresh_errors', 'poll_rounds', 'analyzed',
+                 'rejected', 'logged', 'submitted', 'completed', 'failed')
+
+
+def is_counter_stat(key: str) -> bool:
+    return any(key == name or key.endswith('_' + name) for name in COUNTER_STATS)
+
+
+class StatsCollector(object):
+    '''Exports the numeric values of an existing stats dict (such as LRUCache.stats): running
+    totals (see COUNTER_STATS) as counters named <prefix>_<key>_total, everything else as
+    gauges named <prefix>_<key>. With a labelname, stats_func returns {label value: stats dict}.
+    '''
+    def __init__(self, prefix: str, stats_func: Callable, labelname: str=None):
+        self.prefix = prefix
+        self.stats_func = stats_func
+        self.labelname = labelname
+
+    def render(self) -> list:
+        stats = self.stats_func() or {}
+        series = stats.items() if self.labelname else [(None, stats)]
+
+        samples = {}
+        for labelvalue, series_stats in series:
+            for key, value in (series_stats or {}).items():
+                if isinstance(value, bool) or not isinstance(value, (int, float)):
+                    continue
+                if is_counter_stat(key):
+                    name, metric_type = f'{self.prefix}_{key}_total', 'counter'
+                else:
+                    name, metric_type = f'{self.prefix}_{key}', 'gauge'
+                labels = format_labels((self.labelname,), (labelvalue,)) if self.labelname else ''
+                samples.setdefault((name, metric_type), []).append(f'{name}{labels} {format_value(value)}')
+
+        lines = []
+        for (name, metric_type), name_samples in samples.items():
+            lines.append(f'# TYPE {name} {metric_type}')
+            lines.extend(name_samples)
+        return lines
+
+
+class MetricsRegistry(object):
+    '''Holds the metrics of this process. A pre-forked server's workers each keep and
+    report their own.
+    '''
+    def __init__(self):
+        self.metrics = {}
+
+    def register(self, metric):
+        self.metrics[metric.name if hasattr(metric, 'name') else metric.prefix] = metric
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in list(self.metrics.values()):
+            try:
+                lines.extend(metric.render())
+            except Exception:
+                # a broken collector must not take the rest of the scrape with it
+                continue
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = MetricsRegistry()
+
+FIELD_LATENCY = REGISTRY.register(Histogram('grip_field_duration_seconds',
+                                            'Time to resolve root query and mutation fields.',
+                                            ('operation', 'field')))
+
+HANDLER_LATENCY = REGISTRY.register(Histogram('grip_handler_duration_seconds',
+                                              'Time spent in query, mutation and batch handlers.',
+                                              ('handler',)))
+
+HANDLER_ERRORS = REGISTRY.register(Counter('grip_handler_errors_total',
+                                           'Handler calls which raised.',
+                                           ('handler',)))
+
+SERVICE_LATENCY = REGISTRY.register(Histogram('grip_service_call_duration_seconds',
+                                              'Time spent in service object calls.',
+                                              ('service', 'method')))
+
+SERVICE_BYTES = REGISTRY.register(Counter('grip_service_bytes_total',
+                                          'Bytes transferred by service object calls.',
+                                          ('service', 'method')))
+
+
+def timed_handler(handler: Callable, handler_name: str) -> Callable:
+    if asyncio.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def timed_async_handler(*args, **kwargs):
+            start_time = time.perf_counter()
+            try:
+                return await handler(*args, **kwargs)
+            except Exception:
+                HANDLER_ERRORS.inc(1, handler_name)
+                raise
+            finally:
+                HANDLER_LATENCY.observe(time.perf_counter() - start_time, handler_name)
+
+        return timed_async_handler
+
+    @functools.wraps(handler)
+    def timed_sync_handler(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            return handler(*args, **kwargs)
+        except Exception:
+            HANDLER_ERRORS.inc(1, handler_name)
+            raise
+        finally:
+            HANDLER_LATENCY.observe(time.perf_counter() - start_time, handler_name)
+
+    return timed_sync_handler
+
+
+def timed_resolver(resolver: Callable, operation: str, field_name: str) -> Callable:
+    # async resolvers return an awaitable; time it through to completion
+    async def await_result(result, start_time: float):
+        try:
+            return await result
+        finally:
+            FIELD_LATENCY.observe(time.perf_counter() - start_time, operation, field_name)
+
+    @functools.wraps(resolver)
+    def timed_field_resolver(*args, **kwargs):
+        start_time = time.perf_counter()
+        try:
+            result = resolver(*args, **kwargs)
+        except Exception:
+            FIELD_LATENCY.observe(time.perf_counter() - start_time, operation, field_name)
+            raise
+
+        if isawaitable(result):
+            return await_result(result, start_time)
+
+        FIELD_LATENCY.observe(time.perf_counter() - start_time, operation, field_name)
+        return result
+
+    return timed_field_resolver
+
+
+def instrument_schema(schema):
+    '''Times the resolvers of the root query and mutation fields. Only root fields are
+    wrapped, so nested fields (and the default resolvers of scalars) cost nothing extra.
+    '''
+    for operation, root_type in (('query', schema.query_type), ('mutation', schema.mutation_type)):
+        if root_type is None:
+            continue
+        for field_name, field in root_type.fields.items():
+            if field.resolve is not None:
+                field.resolve = timed_resolver(field.resolve, operation, field_name)
+
+    return schema
+
+
+def register_stats(prefix: str, stats_func: Callable, labelname: str=None):
+    return REGISTRY.register(StatsCollector(prefix, stats_func, labelname))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python
+
+import os, sys
+import gc
+import time
+import errno
+import signal
+import socket
+import logging
+import threading
+from typing import Callable
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 5000
+DEFAULT_GRACEFUL_TIMEOUT = 30
+
+
+class GPreforkServer(object):
+    '''Serves an already-initialized grip app from N forked worker processes which share one
+    listening socket. Everything built before serve() is called (services, the request
+    forwarder and the executable schema) is set up once in the parent and shared with the
+    workers copy-on-write.
+
+    Each worker calls after_fork (if given) before serving, so that services can drop
+    connections they inherited from the parent.
+
+    Signals to the parent: SIGTERM/SIGINT shut down, letting workers finish in-flight
+    requests for up to graceful_timeout seconds; SIGHUP replaces every worker with a fresh
+    one, starting the new workers before stopping the old. Workers that die are replaced.
+    New workers are forked from the same parent state: SIGHUP recycles worker processes,
+    it does not reload the config, the schema or any code.
+    '''
+    def __init__(self,
+                 app,
+                 host: str=DEFAULT_HOST,
+                 port: int=DEFAULT_PORT,
+                 num_workers: int=2,
+                 graceful_timeout: float=DEFAULT_GRACEFUL_TIMEOUT,
+                 asgi: bool=False,
+                 after_fork: Callable=None):
+
+        self.app = app
+        self.host = host
+        self.port = port
+        self.num_workers = num_workers
+        self.graceful_timeout = graceful_timeout
+        self.asgi = asgi
+        self.after_fork = after_fork
+        self.socket = None
+        self.workers = set()
+        self._stopping = False
+        self._restart_requested = False
+
+    def bind(self):
+        # with the protocol named, asyncio turns off Nagle on the connections accepted from it
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM, socket.IPPROTO_TCP)
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.socket.bind((self.host, self.port))
+        self.socket.listen(socket.SOMAXCONN)
+        self.socket.set_inheritable(True)
+
+    def serve(self):
+        self.bind()
+        logger.info(f'grip prefork server listening on {self.host}:{self.port} with {self.num_workers} workers')
+
+        # keep the shared setup out of the collector's reach, so that collections in the
+        # workers do not touch (and so copy) the parent's pages
+        if hasattr(gc, 'freeze'):
+            gc.collect()
+            gc.freeze()
+
+        signal.signal(signal.SIGTERM, self._handle_stop)
+        signal.signal(signal.SIGINT, self._handle_stop)
+        signal.signal(signal.SIGHUP, self._handle_restart)
+
+        for i in range(self.num_workers):
+            self.spawn_worker()
+
+        while not self._stopping:
+            if self._restart_requested:
+                self._restart_requested = False
+                self.restart_workers()
+
+            self.reap_workers(respawn=True)
+            time.sleep(0.5)
+
+        self.stop_workers(self.workers)
+        self.socket.close()
+
+    def _handle_stop(self, signum, frame):
+        self._stopping = True
+
+    def _handle_restart(self, signum, frame):
+        self._restart_requested = True
+
+    def spawn_worker(self):
+        pid = os.fork()
+        if pid:
+            self.workers.add(pid)
+            return pid
+
+        # in the worker process
+        exit_code = 0
+        try:
+            signal.signal(signal.SIGHUP, signal.SIG_IGN)
+            signal.signal(signal.SIGINT, signal.SIG_IGN)
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            if self.after_fork:
+                self.after_fork()
+            if self.asgi:
+                self.run_asgi_worker()
+            else:
+                self.run_wsgi_worker()
+        except Exception:
+            logger.exception(f'grip worker {os.getpid()} failed')
+            exit_code = 1
+        finally:
+            os._exit(exit_code)
+
+    def run_wsgi_worker(self):
+        from werkzeug.serving import make_server
+
+        server = make_server(self.host, self.port, self.app, threaded=True, fd=self.socket.fileno())
+        # on shutdown, wait for request threads to finish rather than abandoning them
+        server.daemon_threads = False
+
+        def stop(signum, frame):
+            threading.Thread(target=server.shutdown, daemon=True).start()
+
+        signal.signal(signal.SIGTERM, stop)
+        server.serve_forever()
+        server.server_close()
+
+    def run_asgi_worker(self):
+        import uvicorn
+
+        # uvicorn installs its own SIGTERM handler, which drains in-flight requests
+        config = uvicorn.Config(self.app, timeout_graceful_shutdown=self.graceful_timeout)
+        uvicorn.Server(config).run(sockets=[self.socket])
+
+    def reap_workers(self, respawn: bool=False):
+        while True:
+            try:
+                pid, status = os.waitpid(-1, os.WNOHANG)
+            except OSError as err:
+                if err.errno == errno.ECHILD:
+                    return
+                raise
+
+            if pid == 0:
+                return
+
+            if pid in self.workers:
+                self.workers.discard(pid)
+                if respawn and not self._stopping:
+                    logger.warning(f'grip worker {pid} exited with status {status}; starting a replacement')
+                    self.spawn_worker()
+
+    def restart_workers(self):
+        old_workers = set(self.workers)
+        for i in range(self.num_workers):
+            self.spawn_worker()
+        self.stop_workers(old_workers)
+
+    def stop_workers(self, pids: set):
+        for pid in list(pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                self.workers.discard(pid)
+
+        deadline = time.monotonic() + self.graceful_timeout
+        while pids & self.workers and time.monotonic() < deadline:
+            self.reap_workers()
+            time.sleep(0.1)
+
+        for pid in pids & self.workers:
+            logger.warning(f'grip worker {pid} did not stop within {self.graceful_timeout}s; killing it')
+            try:
+                os.kill(pid, signal.SIGKILL)
+                os.waitpid(pid, 0)
+            except (ProcessLookupError, ChildProcessError):
+                pass
+            self.workers.discard(pid)
+
+
+def run(app, grip_globals: dict, asgi: bool=False, after_fork: Callable=None):
+    '''Entry point for generated apps run as scripts. Serves on globals.host/globals.port;
+    with globals.workers above 1, forks that many workers from the fully set-up parent,
+    each of which calls after_fork before serving.
+    '''
+    host = grip_globals.get('host') or DEFAULT_HOST
+    port = int(grip_globals.get('port') or DEFAULT_PORT)
+    num_workers = int(grip_globals.get('workers') or 1)
+
+    if num_workers > 1:
+        graceful_timeout = float(grip_globals.get('graceful_timeout') or DEFAULT_GRACEFUL_TIMEOUT)
+        GPreforkServer(app, host, port, num_workers, graceful_timeout, asgi=asgi, after_fork=after_fork).serve()
+
+    elif asgi:
+        import uvicorn
+        uvicorn.run(app, host=host, port=port)
+
+    else:
+        app.run(host=host, port=port, debug=app.debug)
@@ -0,0 +1,140 @@
+#!/usr/bin/env python
+
+import sys
+import json
+import time
+import random
+import hashlib
+import logging
+
+from griptrace import GTracer, format_timestamp
+
+
+DEFAULT_SLOW_REQUEST_MS = 1000
+DEFAULT_SLOW_LOG_SAMPLE_RATE = 0.01
+DEFAULT_SLOW_LOG_TOP_N = 5
+DEFAULT_REDACTED_VARIABLES = ('password', 'secret', 'token', 'credential', 'apikey', 'api_key')
+DEFAULT_MAX_VALUE_LENGTH = 256
+
+REDACTED = '[REDACTED]'
+
+
+def query_hash(data: dict) -> str:
+    '''sha256 of the query text; for APQ requests sent by hash alone, that hash
+    (which is the same value).
+    '''
+    query = data.get('query')
+    if isinstance(query, str):
+        return hashlib.sha256(query.encode('utf-8')).hexdigest()
+
+    extensions = data.get('extensions')
+    persisted_query = extensions.get('persistedQuery') if isinstance(extensions, dict) else None
+    return persisted_query.get('sha256Hash') if isinstance(persisted_query, dict) else None
+
+
+class GSlowRequestLog(object):
+    '''Writes one JSON line for each request slower than threshold_ms.
+
+    Every request's total time is checked against the threshold. Breaking that time down
+    by field and handler means tracing the request, so only a sample_rate fraction of
+    requests (chosen before they run) are traced; a slow request outside the sample is
+    logged with its total time and empty phase and slowest-call lists.
+    Variables whose names contain any of the redacted names are masked, and long string
+    values are truncated.
+    '''
+    def __init__(self,
+                 threshold_ms: float=DEFAULT_SLOW_REQUEST_MS,
+                 sample_rate: float=DEFAULT_SLOW_LOG_SAMPLE_RATE,
+                 top_n: int=DEFAULT_SLOW_LOG_TOP_N,
+                 redacted_variables: tuple=DEFAULT_REDACTED_VARIABLES,
+                 max_value_length: int=DEFAULT_MAX_VALUE_LENGTH,
+                 log: logging.Logger=None):
+
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.top_n = top_n
+        self.redacted_variables = tuple(name.lower() for name in redacted_variables)
+        self.max_value_length = max_value_length
+        self.log = log or logging.getLogger('grip.slow_requests')
+        self.logged = 0
+
+    def sample(self) -> bool:
+        return self.sample_rate >= 1 or random.random() < self.sample_rate
+
+    def is_redacted(self, name: str) -> bool:
+        name = name.lower()
+        return any(redacted in name for redacted in self.redacted_variables)
+
+    def redact(self, value):
+        if isinstance(value, dict):
+            return {key: REDACTED if self.is_redacted(str(key)) else self.redact(item) for key, item in value.items()}
+        if isinstance(value, list):
+            return [self.redact(item) for item in value]
+        if isinstance(value, str) and len(value) > self.max_value_length:
+            return value[:self.max_value_length] + f'...({len(value)} chars)'
+        return value
+
+    def slowest(self, timings: list, name_func) -> list:
+        timings = sorted(timings, key=lambda timing: timing['duration'], reverse=True)[:self.top_n]
+        return [{'name': name_func(timing), 'ms': round(timing['duration'] / 1e6, 3)} for timing in timings]
+
+    def record(self, data: dict, start_counter: float, tracer: GTracer=None, error_count: int=0):
+        '''start_counter is the time.perf_counter() reading taken as the request started.
+        '''
+        duration_ms = (time.perf_counter() - start_counter) * 1000
+        if duration_ms < self.threshold_ms:
+            return
+
+        traced = tracer is not None
+        if not traced:
+            # outside the sample: only the total time is known, so the breakdown stays empty
+            tracer = GTracer(reported=False)
+
+        entry = {
+            'timestamp': format_timestamp(time.time() - duration_ms / 1000),
+            'operationName': data.get('operationName'),
+            'queryHash': query_hash(data),
+            'variables': self.redact(data.get('variables') or {}),
+            'durationMs': round(duration_ms, 3),
+            'errors': error_count,
+            'traced': traced,
+            'phasesMs': {name: round(phase['duration'] / 1e6, 3) for name, phase in tracer.phases.items()},
+            'slowestFields': self.slowest(tracer.resolvers, lambda timing: '.'.join(str(p) for p in timing['path'])),
+            'slowestHandlers': self.slowest(tracer.handlers, lambda timing: timing['name']),
+            'spans': self.slowest(tracer.spans, lambda timing: timing['name'])
+        }
+        self.log.warning(json.dumps(entry, default=str))
+        self.logged += 1
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'logged': self.logged,
+            'threshold_ms': self.threshold_ms,
+            'sample_rate': self.sample_rate
+        }
+
+
+def create_slow_request_log(grip_globals: dict) -> GSlowRequestLog:
+    '''Returns a slow-request log if globals.slow_request_ms is set; otherwise None.
+    Lines go to globals.slow_log_file if set, or to stderr.
+    '''
+    threshold_ms = grip_globals.get('slow_request_ms')
+    if not threshold_ms:
+        return None
+
+    log = logging.getLogger('grip.slow_requests')
+    if not log.handlers:
+        log_file = grip_globals.get('slow_log_file')
+        handler = logging.FileHandler(log_file) if log_file else logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter('%(message)s'))
+        log.addHandler(handler)
+        log.propagate = False
+
+    redacted_variables = grip_globals.get('slow_log_redact') or DEFAULT_REDACTED_VARIABLES
+    sample_rate = grip_globals.get('slow_log_sample_rate')
+    return GSlowRequestLog(float(threshold_ms),
+                           sample_rate=float(DEFAULT_SLOW_LOG_SAMPLE_RATE if sample_rate is None else sample_rate),
+                           top_n=int(grip_globals.get('slow_log_top_n') or DEFAULT_SLOW_LOG_TOP_N),
+                           redacted_variables=tuple(redacted_variables),
+                           log=log)
@@ -0,0 +1,188 @@
+#!/usr/bin/env python
+
+import time
+import asyncio
+import datetime
+import functools
+from contextlib import contextmanager
+from inspect import isawaitable
+from typing import Callable
+
+
+TRACING_VERSION = 1
+DEFAULT_TRACING_HEADER = 'X-Grip-Tracing'
+TRACING_HEADER_VALUES = ('1', 'true', 'yes', 'on')
+
+
+class NullSpan(object):
+    '''Stands in for a span when the request is not being traced.
+    '''
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+NULL_SPAN = NullSpan()
+
+
+def format_timestamp(epoch_time: float) -> str:
+    utc_time = datetime.datetime.fromtimestamp(epoch_time, datetime.timezone.utc)
+    return utc_time.replace(tzinfo=None).isoformat() + 'Z'
+
+
+class GTracer(object):
+    '''Records the timings of one operation in the shape of the Apollo tracing extension.
+    Offsets and durations are nanoseconds from the start of the request.
+
+    Parsing and validation are only timed when the document is not already in the
+    document cache; on a hit, both are reported with zero duration.
+
+    Requests sampled for the slow-request log are traced too, but their tracing is
+    only reported to the client if it was asked for.
+    '''
+    def __init__(self, reported: bool=True):
+        self.reported = reported
+        self.start_time = time.time()
+        self.start_counter = time.perf_counter()
+        self.phases = {}
+        self.resolvers = []
+        self.handlers = []
+        self.spans = []
+
+    def offset(self) -> int:
+        return int((time.perf_counter() - self.start_counter) * 1e9)
+
+    @contextmanager
+    def phase(self, name: str):
+        start_offset = self.offset()
+        try:
+            yield self
+        finally:
+            self.phases[name] = {'startOffset': start_offset, 'duration': self.offset() - start_offset}
+
+    @contextmanager
+    def span(self, name: str):
+        '''Custom span, e.g. around a service call made by a handler.
+        '''
+        start_offset = self.offset()
+        try:
+            yield self
+        finally:
+            self.spans.append({'name': name, 'startOffset': start_offset, 'duration': self.offset() - start_offset})
+
+    @contextmanager
+    def handler_call(self, handler_name: str):
+        start_offset = self.offset()
+        try:
+            yield self
+        finally:
+            self.handlers.append({'name': handler_name,
+                                  'startOffset': start_offset,
+                                  'duration': self.offset() - start_offset})
+
+    def record_resolver(self, info, start_offset: int):
+        self.resolvers.append({
+            'path': info.path.as_list(),
+            'parentType': info.parent_type.name,
+            'fieldName': info.field_name,
+            'returnType': str(info.return_type),
+            'startOffset': start_offset,
+            'duration': self.offset() - start_offset
+        })
+
+    async def await_resolver(self, result, info, start_offset: int):
+        try:
+            return await result
+        finally:
+            self.record_resolver(info, start_offset)
+
+    def resolve(self, next_resolver, obj, info, **kwargs):
+        '''Resolver middleware; only installed for traced requests.
+        '''
+        start_offset = self.offset()
+        try:
+            result = next_resolver(obj, info, **kwargs)
+        except Exception:
+            self.record_resolver(info, start_offset)
+            raise
+
+        if isawaitable(result):
+            return self.await_resolver(result, info, start_offset)
+
+        self.record_resolver(info, start_offset)
+        return result
+
+    def to_dict(self) -> dict:
+        duration = self.offset()
+        skipped_phase = {'startOffset': 0, 'duration': 0}
+        return {
+            'version': TRACING_VERSION,
+            'startTime': format_timestamp(self.start_time),
+            'endTime': format_timestamp(self.start_time + duration / 1e9),
+            'duration': duration,
+            'parsing': self.phases.get('parsing', skipped_phase),
+            'validation': self.phases.get('validation', skipped_phase),
+            'execution': dict(self.phases.get('execution', skipped_phase), resolvers=self.resolvers),
+            'handlers': self.handlers,
+            'spans': self.spans
+        }
+
+
+def trace_phase(tracer: GTracer, name: str):
+    if tracer is None:
+        return NULL_SPAN
+    return tracer.phase(name)
+
+
+def tracing_requested(http_request, header_name: str) -> bool:
+    headers = getattr(http_request, 'headers', None)
+    if not header_name or headers is None:
+        return False
+    return str(headers.get(header_name, '')).lower() in TRACING_HEADER_VALUES
+
+
+def request_tracer(handler_kwargs: dict) -> GTracer:
+    request_context = handler_kwargs.get('request_context')
+    return getattr(request_context, 'tracer', None)
+
+
+def traced_handler(handler: Callable, handler_name: str) -> Callable:
+    '''Records each call of a handler made on behalf of a traced request.
+    '''
+    if asyncio.iscoroutinefunction(handler):
+        @functools.wraps(handler)
+        async def traced_async_handler(*args, **kwargs):
+            tracer = request_tracer(kwargs)
+            if tracer is None:
+                return await handler(*args, **kwargs)
+            with tracer.handler_call(handler_name):
+                return await handler(*args, **kwargs)
+
+        return traced_async_handler
+
+    @functools.wraps(handler)
+    def traced_sync_handler(*args, **kwargs):
+        tracer = request_tracer(kwargs)
+        if tracer is None:
+            return handler(*args, **kwargs)
+        with tracer.handler_call(handler_name):
+            return handler(*args, **kwargs)
+
+    return traced_sync_handler
+
+
+def handler_span(handler_kwargs: dict, name: str):
+    '''Opens a custom span from inside a handler:
+
+        with griptrace.handler_span(kwargs, 'athena poll'):
+            ...
+
+    A no-op when the request is not traced, or when the handler was called without
+    a request context (e.g. as a background job).
+    '''
+    request_context = handler_kwargs.get('request_context')
+    if request_context is None:
+        return NULL_SPAN
+    return request_context.span(name)
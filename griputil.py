@@ -2,6 +2,7 @@
 
 
 import os, sys
+import hashlib
 from collections import namedtuple
 import yaml
 import jinja2
@@ -10,24 +11,58 @@ from snap import common
 from templates import GQL_QUERY_TEMPLATE
 from templates import GQL_MUTATION_TEMPLATE
 from templates import GQL_TYPE_TEMPLATE
+from templates import GQL_JOB_TYPES_TEMPLATE
 from templates import MAIN_APP_TEMPLATE
+from templates import ASYNC_APP_TEMPLATE
 from templates import RESOLVER_MODULE_TEMPLATE
 from templates import HANDLER_MODULE_TEMPLATE
 from templates import HANDLER_FUNCTION_TEMPLATE
 from templates import QUERY_RESOLVER_FUNCTION_TEMPLATE
 from templates import MUTATION_RESOLVER_FUNCTION_TEMPLATE
+from templates import BATCH_HANDLER_FUNCTION_TEMPLATE
+from templates import OBJECT_TYPE_DECLARATION_TEMPLATE
+from templates import BATCH_FIELD_RESOLVER_FUNCTION_TEMPLATE
+
+from gripjobs import JOB_STATUS_QUERY
 
 
 GQLArg = namedtuple('GQLArg', 'name datatype')
 GQLTypespecField = namedtuple('GQLTypespecField', 'name datatype')
 
 
+# one environment for every generate_* call; each template is compiled on first use only
+J2_ENV = jinja2.Environment(loader=jinja2.DictLoader({
+    'gql_query': GQL_QUERY_TEMPLATE,
+    'gql_mutation': GQL_MUTATION_TEMPLATE,
+    'gql_type': GQL_TYPE_TEMPLATE,
+    'gql_job_types': GQL_JOB_TYPES_TEMPLATE,
+    'main_app': MAIN_APP_TEMPLATE,
+    'async_app': ASYNC_APP_TEMPLATE,
+    'resolver_module': RESOLVER_MODULE_TEMPLATE,
+    'handler_module': HANDLER_MODULE_TEMPLATE,
+    'handler_function': HANDLER_FUNCTION_TEMPLATE,
+    'query_resolver_function': QUERY_RESOLVER_FUNCTION_TEMPLATE,
+    'mutation_resolver_function': MUTATION_RESOLVER_FUNCTION_TEMPLATE,
+    'batch_handler_function': BATCH_HANDLER_FUNCTION_TEMPLATE,
+    'object_type_declaration': OBJECT_TYPE_DECLARATION_TEMPLATE,
+    'batch_field_resolver_function': BATCH_FIELD_RESOLVER_FUNCTION_TEMPLATE
+}), auto_reload=False)
+
+
 class GQLQuerySpec(object):
-    def __init__(self, name: str, return_type: str, *gql_query_args: GQLArg):
+    def __init__(self, name: str, return_type: str, *gql_query_args: GQLArg, is_job: bool=False, builtin: bool=False):
         # TODO: check for trailing '!' in type names
         self.name = name
-        self.return_type = return_type
+        self.result_type = return_type
         self.query_args = gql_query_args
+        # job ("async: true") queries return their Job, and the result comes from jobStatus
+        self.is_job = is_job
+        # builtin queries are handled by grip itself, and get no stub in the handler module
+        self.builtin = builtin
+
+    @property
+    def return_type(self):
+        return 'Job!' if self.is_job else self.result_type
         
 
     @property
@@ -59,10 +94,17 @@ class GQLMutationSpec(object):
 
 
 class GQLTypespec(object):
-    def __init__(self, name: str, fields: dict):
+    def __init__(self, name: str, fields: dict, object_type_names=()):
         self.name = name
         self.fields = [GQLTypespecField(name=fname, datatype=ftype) for fname, ftype in fields.items()]
 
+        # fields of an object type are resolved through per-request batch loaders
+        self.batch_fields = [f for f in self.fields if f.datatype.strip('[]!') in object_type_names]
+
+    @property
+    def has_batch_fields(self):
+        return len(self.batch_fields) > 0
+
 
 class GProjectConfig(object):
 
@@ -72,8 +114,10 @@ class GProjectConfig(object):
         self.resolver_module = ''
         self.handler_module = ''
         self.object_types = []
+        self.batch_types = []
         self.query_specs = []
         self.mutation_specs = []
+        self.metrics = False
 
     def set_home_dir(self, home_dir):
         if home_dir[0] == '/':
@@ -86,6 +130,9 @@ class GProjectConfig(object):
 
     def add_object_type(self, obj_type: str):
         self.object_types.append(obj_type)
+
+    def add_batch_type(self, obj_type: str):
+        self.batch_types.append(obj_type)
     
     def set_resolver_module(self, module: str):
         self.resolver_module = module
@@ -93,6 +140,9 @@ class GProjectConfig(object):
     def set_handler_module(self, module: str):
         self.handler_module = module
 
+    def set_metrics(self, enabled: bool):
+        self.metrics = enabled
+
     def add_query_spec(self, qspec: GQLQuerySpec):
         self.query_specs.append(qspec)
 
@@ -101,84 +151,129 @@ class GProjectConfig(object):
         
 
 
+class GSpecModel(object):
+    '''The query, mutation and type specs of one YAML config. A codegen run parses its
+    config into one of these and passes it to each generator; a generator given no
+    spec model parses the config itself.
+    '''
+    def __init__(self, yaml_config: dict):
+        self.query_specs = load_query_specs(yaml_config)
+        self.mutation_specs = load_mutation_specs(yaml_config)
+        self.type_specs = load_type_specs(yaml_config)
+
+    @property
+    def has_job_queries(self):
+        return has_job_queries(self.query_specs)
+
+
 class GProjectBuilder(object):
     @staticmethod
-    def build_project(schema_filename: str, yaml_config: dict) -> GProjectConfig:
+    def build_project(schema_filename: str, yaml_config: dict, spec_model: GSpecModel=None) -> GProjectConfig:
         project_conf = GProjectConfig()
         project_conf.set_home_dir(common.load_config_var(yaml_config['globals']['project_home']))
         project_conf.set_schema_file(schema_filename)
         project_conf.set_resolver_module(yaml_config['globals']['resolver_module'])
         project_conf.set_handler_module(yaml_config['globals']['handler_module'])
+        project_conf.set_metrics(bool(yaml_config['globals'].get('metrics')))
 
-        for typespec in load_type_specs(yaml_config):
+        spec_model = spec_model or GSpecModel(yaml_config)
+        for typespec in spec_model.type_specs:
             project_conf.add_object_type(typespec.name)
+            if typespec.has_batch_fields:
+                project_conf.add_batch_type(typespec.name)
 
-        for qspec in load_query_specs(yaml_config):
+        for qspec in spec_model.query_specs:
             project_conf.add_query_spec(qspec)
 
-        for mspec in load_mutation_specs(yaml_config):
+        for mspec in spec_model.mutation_specs:
             project_conf.add_mutation_spec(mspec)
 
         return project_conf
 
 
-def generate_handler_source(yaml_config: dict) -> str:
-
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-    template = j2env.from_string(HANDLER_MODULE_TEMPLATE)
-    
-    qspecs = load_query_specs(yaml_config)
-    return template.render(query_specs=qspecs)
+def generate_handler_source(yaml_config: dict, spec_model: GSpecModel=None) -> str:
+    spec_model = spec_model or GSpecModel(yaml_config)
+    return J2_ENV.get_template('handler_module').render(query_specs=spec_model.query_specs,
+                                                         type_specs=spec_model.type_specs)
 
 
 def generate_handler_function(name: str) -> str:
-
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-    template = j2env.from_string(HANDLER_FUNCTION_TEMPLATE)
-    return template.render(handler_name=name)
+    return J2_ENV.get_template('handler_function').render(handler_name=name)
 
 
-def generate_app_source(schema_filename: str, yaml_config: dict) -> str:
+def generate_batch_handler_function(name: str) -> str:
+    return J2_ENV.get_template('batch_handler_function').render(handler_name=name)
 
-    project_conf = GProjectBuilder.build_project(schema_filename, yaml_config)
 
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-    template = j2env.from_string(MAIN_APP_TEMPLATE)
-    
+def generate_app_source(schema_filename: str,
+                        yaml_config: dict,
+                        async_mode: bool=False,
+                        spec_model: GSpecModel=None) -> str:
+    project_conf = GProjectBuilder.build_project(schema_filename, yaml_config, spec_model)
+    template = J2_ENV.get_template('async_app' if async_mode else 'main_app')
     return template.render(project=project_conf)
 
 
-def generate_resolver_source(yaml_config: dict) -> str:
+def generate_resolver_source(yaml_config: dict, async_mode: bool=False, spec_model: GSpecModel=None) -> str:
+    spec_model = spec_model or GSpecModel(yaml_config)
+    return J2_ENV.get_template('resolver_module').render(query_specs=spec_model.query_specs,
+                                                          mutation_specs=spec_model.mutation_specs,
+                                                          type_specs=spec_model.type_specs,
+                                                          async_mode=async_mode)
+
+
+def generate_query_resolver_function(qspec: GQLQuerySpec, async_mode: bool=False) -> str:
+    return J2_ENV.get_template('query_resolver_function').render(query_spec=qspec, async_mode=async_mode)
+
+
+def generate_mutation_resolver_function(mspec: GQLMutationSpec, async_mode: bool=False) -> str:
+    return J2_ENV.get_template('mutation_resolver_function').render(mutation_spec=mspec, async_mode=async_mode)
+
 
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-    template = j2env.from_string(RESOLVER_MODULE_TEMPLATE)
+def generate_object_type_declaration(typespec: GQLTypespec) -> str:
+    return J2_ENV.get_template('object_type_declaration').render(typespec=typespec)
 
-    qspecs = load_query_specs(yaml_config)
-    mspecs = load_mutation_specs(yaml_config)
 
-    return template.render(query_specs=qspecs, mutation_specs=mspecs)
+def generate_batch_field_resolver_function(typespec: GQLTypespec, field: GQLTypespecField) -> str:
+    return J2_ENV.get_template('batch_field_resolver_function').render(typespec=typespec, field=field)
 
 
-def generate_query_resolver_function(qspec: GQLQuerySpec) -> str:
+def content_hash(content) -> str:
+    if isinstance(content, str):
+        content = content.encode('utf-8')
+    return hashlib.sha256(content).hexdigest()
 
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-    template = j2env.from_string(QUERY_RESOLVER_FUNCTION_TEMPLATE)
 
-    return template.render(query_spec=qspec)
+def file_hash(filepath: str) -> str:
+    '''sha256 of a file's contents, or None if there is no such file.
+    '''
+    try:
+        with open(filepath, 'rb') as f:
+            return content_hash(f.read())
+    except FileNotFoundError:
+        return None
 
 
-def generate_mutation_resolver_function(mspec: GQLMutationSpec) -> str:
+def write_if_changed(filepath: str, content: str) -> bool:
+    '''Writes a generated artifact unless the file already holds exactly this content,
+    so that unchanged outputs keep their mtimes (and downstream build caches stay valid).
+    Returns True if the file was written.
+    '''
+    if file_hash(filepath) == content_hash(content):
+        return False
 
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-    template = j2env.from_string(MUTATION_RESOLVER_FUNCTION_TEMPLATE)
+    with open(filepath, 'w') as f:
+        f.write(content)
+    return True
 
-    return template.render(mutation_spec=mspec)
+
+def read_config_file(filename: str) -> dict:
+    '''Like snap's common.read_config_file, but parses with libyaml when PyYAML was
+    built with it; the pure-Python loader dominates codegen time for large configs.
+    '''
+    loader = getattr(yaml, 'CSafeLoader', yaml.SafeLoader)
+    with open(filename, 'r') as f:
+        return yaml.load(f, Loader=loader)
 
 
 def input_param_to_args(param):
@@ -202,11 +297,19 @@ def load_query_specs(yaml_config: dict) -> list:
                 query_args.extend(input_param_to_args(ip))
                 
         return_type = query_segment[name]['output']
-        query_specs.append(GQLQuerySpec(query_name, return_type, *query_args))
+        is_job = bool(query_segment[name].get('async'))
+        query_specs.append(GQLQuerySpec(query_name, return_type, *query_args, is_job=is_job))
+
+    if has_job_queries(query_specs):
+        query_specs.append(GQLQuerySpec(JOB_STATUS_QUERY, 'JobStatus', GQLArg(name='id', datatype='ID!'), builtin=True))
     
     return query_specs
 
 
+def has_job_queries(query_specs: list) -> bool:
+    return any(qspec.is_job for qspec in query_specs)
+
+
 def load_mutation_specs(yaml_config: dict) -> list:
     mutation_specs = []
     mutation_segment = yaml_config.get('mutation_defs')
@@ -234,29 +337,30 @@ def load_type_specs(yaml_config: dict) -> list:
 
         field_dict = {}
         for field_name, field_value in raw_field_dict.items():
+            # fields may use the long form {type: ..., cost: ..., multiplier: ...}
+            if isinstance(field_value, dict):
+                field_value = field_value['type']
+
             if field_value.__class__ == list:
                 field_dict[field_name] = f'[{field_value[0]}]'
             else:
                 field_dict[field_name] = field_value
 
-        type_specs.append(GQLTypespec(name, field_dict))
+        type_specs.append(GQLTypespec(name, field_dict, type_segment.keys()))
 
     return type_specs
 
 
-def create_gql_schema(yaml_config: dict) -> str:
-    
-    j2env = jinja2.Environment()
-    template_mgr = common.JinjaTemplateManager(j2env)
-
-    query_template = j2env.from_string(GQL_QUERY_TEMPLATE)
-    query_schema = query_template.render(query_specs=load_query_specs(yaml_config))
+def create_gql_schema(yaml_config: dict, spec_model: GSpecModel=None) -> str:
+    spec_model = spec_model or GSpecModel(yaml_config)
 
-    mutation_template = j2env.from_string(GQL_MUTATION_TEMPLATE)
-    mutation_schema = mutation_template.render(mutation_specs=load_mutation_specs(yaml_config))
+    query_schema = J2_ENV.get_template('gql_query').render(query_specs=spec_model.query_specs)
+    mutation_schema = J2_ENV.get_template('gql_mutation').render(mutation_specs=spec_model.mutation_specs)
+    types_schema = J2_ENV.get_template('gql_type').render(type_specs=spec_model.type_specs)
 
-    types_template = j2env.from_string(GQL_TYPE_TEMPLATE)
-    types_schema = types_template.render(type_specs=load_type_specs(yaml_config))
+    job_types_schema = ''
+    if spec_model.has_job_queries:
+        job_types_schema = J2_ENV.get_template('gql_job_types').render()
 
-    return ''.join([query_schema, mutation_schema, types_schema])
+    return ''.join([query_schema, mutation_schema, types_schema, job_types_schema])
 
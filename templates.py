@@ -40,11 +40,34 @@ type {{ typespec.name }} {
 
 """
 
+GQL_JOB_TYPES_TEMPLATE = """
+type Job {
+    id: ID!
+    status: String!
+}
+
+type JobStatus {
+    id: ID!
+    query: String!
+    status: String!
+    result: String
+    error: String
+    submittedAt: Float!
+    finishedAt: Float
+}
+
+"""
+
 HANDLER_FUNCTION_TEMPLATE = """
 def {{ handler_name }}(input_data, service_registry, **kwargs):
     return None
 """
 
+BATCH_HANDLER_FUNCTION_TEMPLATE = """
+def {{ handler_name }}(keys, service_registry, **kwargs):
+    return [None for key in keys]
+"""
+
 HANDLER_MODULE_TEMPLATE = """
 #!/usr/bin/env python
 
@@ -52,12 +75,19 @@ from typing import Any
 import json
 
 
-{% for query_spec in query_specs %}
+{% for query_spec in query_specs if not query_spec.builtin %}
 def {{ query_spec.name }}_func(input_data, service_registry, **kwargs):
     return "placeholder data"
 
 {% endfor -%}
 
+{%- for typespec in type_specs %}{% for field in typespec.batch_fields %}
+def {{ typespec.name }}_{{ field.name }}_batch_func(keys, service_registry, **kwargs):
+    # return one result per key, in the same order as the keys
+    return [None for key in keys]
+
+{% endfor %}{% endfor -%}
+
 """
 
 RESOLVER_MODULE_TEMPLATE = """
@@ -75,7 +105,7 @@ mutation = MutationType()
 
 {% for query_spec in query_specs %}
 @query.field("{{ query_spec.name }}")
-def resolve_{{ query_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
+{% if async_mode %}async {% endif %}def resolve_{{ query_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
     grip_context = info.context # GRequestContext object
 
     request = grip_context.request
@@ -83,13 +113,17 @@ def resolve_{{ query_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
     forwarder = grip_context.forwarder
 
     handler_func = forwarder.lookup_query_handler('{{ query_spec.name }}')
-    return handler_func(kwargs, service_registry)
+    {% if async_mode -%}
+    return await forwarder.invoke_async(handler_func, kwargs, service_registry, request_context=grip_context)
+    {%- else -%}
+    return handler_func(kwargs, service_registry, request_context=grip_context)
+    {%- endif %}
 
 {% endfor %}
 
 {%- for mutation_spec in mutation_specs %}
 @mutation.field("{{ mutation_spec.name }}")
-def resolve_{{ mutation_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
+{% if async_mode %}async {% endif %}def resolve_{{ mutation_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
     grip_context = info.context # GRequestContext object
 
     request = grip_context.request
@@ -97,15 +131,31 @@ def resolve_{{ mutation_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwarg
     forwarder = grip_context.forwarder
 
     handler_func = forwarder.lookup_mutation_handler('{{ mutation_spec.name }}')
-    return handler_func(kwargs, service_registry)
+    {% if async_mode -%}
+    return await forwarder.invoke_async(handler_func, kwargs, service_registry, request_context=grip_context)
+    {%- else -%}
+    return handler_func(kwargs, service_registry, request_context=grip_context)
+    {%- endif %}
 
 {% endfor %}
 
+{%- for typespec in type_specs if typespec.has_batch_fields %}
+{{ typespec.name }}_type = ObjectType("{{ typespec.name }}")
+
+{% for field in typespec.batch_fields %}
+@{{ typespec.name }}_type.field("{{ field.name }}")
+def resolve_{{ typespec.name }}_{{ field.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
+    grip_context = info.context # GRequestContext object
+    return grip_context.load_field('{{ typespec.name }}', '{{ field.name }}', obj)
+
+{% endfor %}
+{%- endfor %}
+
 """
 
 QUERY_RESOLVER_FUNCTION_TEMPLATE = """
 @query.field("{{ query_spec.name }}")
-def resolve_{{ query_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
+{% if async_mode %}async {% endif %}def resolve_{{ query_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
     grip_context = info.context # GRequestContext object
 
     request = grip_context.request
@@ -113,21 +163,42 @@ def resolve_{{ query_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
     forwarder = grip_context.forwarder
 
     handler_func = forwarder.lookup_query_handler('{{ query_spec.name }}')
-    return handler_func(kwargs, service_registry)
+    {% if async_mode -%}
+    return await forwarder.invoke_async(handler_func, kwargs, service_registry, request_context=grip_context)
+    {%- else -%}
+    return handler_func(kwargs, service_registry, request_context=grip_context)
+    {%- endif %}
 
 """
 
 MUTATION_RESOLVER_FUNCTION_TEMPLATE = """
 @mutation.field("{{ mutation_spec.name }}")
-def resolve_{{ mutation_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
+{% if async_mode %}async {% endif %}def resolve_{{ mutation_spec.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
     grip_context = info.context # GRequestContext object
 
     request = grip_context.request
     service_registry = grip_context.service_registry
     forwarder = grip_context.forwarder
 
-    handler_func = forwarder.lookup_query_handler('{{ mutation_spec.name }}')
-    return handler_func(kwargs, service_registry)
+    handler_func = forwarder.lookup_mutation_handler('{{ mutation_spec.name }}')
+    {% if async_mode -%}
+    return await forwarder.invoke_async(handler_func, kwargs, service_registry, request_context=grip_context)
+    {%- else -%}
+    return handler_func(kwargs, service_registry, request_context=grip_context)
+    {%- endif %}
+
+"""
+
+OBJECT_TYPE_DECLARATION_TEMPLATE = """
+{{ typespec.name }}_type = ObjectType("{{ typespec.name }}")
+
+"""
+
+BATCH_FIELD_RESOLVER_FUNCTION_TEMPLATE = """
+@{{ typespec.name }}_type.field("{{ field.name }}")
+def resolve_{{ typespec.name }}_{{ field.name }}(obj: Any, info: GraphQLResolveInfo, **kwargs):
+    grip_context = info.context # GRequestContext object
+    return grip_context.load_field('{{ typespec.name }}', '{{ field.name }}', obj)
 
 """
 
@@ -137,10 +208,15 @@ MAIN_APP_TEMPLATE = """
 
 import os, sys
 
-from ariadne import graphql_sync, make_executable_schema, load_schema_from_path, ObjectType, QueryType
+from ariadne import ObjectType, QueryType
 from ariadne.constants import PLAYGROUND_HTML
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request
 import core
+import gripjson
+{% if project.metrics -%}
+import gripmetrics
+{% endif -%}
+import gripserver
 
 sys.path.append('{{ project.home_dir }}')
 
@@ -161,35 +237,140 @@ app = core.setup(flask_runtime)
 service_registry = app.config.get('services')
 forwarder = app.config.get('forwarder')
 
-typedefs = load_schema_from_path('{{ project.schema_file }}')
-
 bindables = []
 {% if project.query_specs|length -%}bindables.append(r.query){%- endif %}
 {%+ if project.mutation_specs|length %}bindables.append(r.mutation){% endif %}
 {% for typename in project.object_types %}
 bindables.append(ObjectType('{{ typename }}'))
 {%- endfor %}
-schema = make_executable_schema(typedefs, bindables)
+{% for typename in project.batch_types %}
+bindables.append(r.{{ typename }}_type)
+{%- endfor %}
+schema = core.load_executable_schema('{{ project.schema_file }}', bindables, app.config['grip_config'])
+executor = core.create_query_executor(app, schema)
+json_encoder = gripjson.create_json_encoder(app.config['grip_config']['globals'])
 
 @app.route('/graphql', methods=['GET'])
 def playground():
     return PLAYGROUND_HTML, 200
 
 
+{% if project.metrics -%}
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    return Response(gripmetrics.REGISTRY.render(), mimetype=gripmetrics.CONTENT_TYPE)
+
+
+{% endif -%}
 @app.route('/graphql', methods=['POST'])
 def graphql_server():
     data = request.get_json()
-    request_context = core.GRequestContext(request, forwarder, service_registry)
-    success, result = graphql_sync(schema,
-                                   data,
-                                   context_value=request_context,
-                                   debug=app.debug)
+    # batched operations run on other threads, which cannot see flask's request proxy
+    http_request = request._get_current_object()
+    new_context = lambda: core.GRequestContext(http_request, forwarder, service_registry)
+
+    if isinstance(data, list):
+        success, result = executor.execute_batch_sync(data, new_context)
+    else:
+        success, result = executor.execute_sync(data, new_context())
 
     status_code = 200 if success else 400
-    return jsonify(result), status_code
+    # large results come back as an iterator of chunks, which flask sends chunked
+    return Response(json_encoder.encode_body(result), status=status_code, mimetype='application/json')
     
 
 if __name__ == '__main__':
-    app.run(debug=True)
+    gripserver.run(app, app.config['grip_config']['globals'], after_fork=service_registry.after_fork)
+
+"""
+
+
+ASYNC_APP_TEMPLATE = """
+#!/usr/bin/env python
+
+import os, sys
+
+from ariadne import ObjectType, QueryType
+from ariadne.constants import PLAYGROUND_HTML
+from starlette.applications import Starlette
+from starlette.responses import HTMLResponse, Response, StreamingResponse
+from starlette.routing import Route
+import core
+import gripjson
+{% if project.metrics -%}
+import gripmetrics
+{% endif -%}
+import gripserver
+
+sys.path.append('{{ project.home_dir }}')
+
+import {{ project.resolver_module }} as r
+import {{ project.handler_module }} 
+
+
+if __name__ == '__main__':
+    print('starting GRIP graphql service in standalone (debug) mode...')
+    grip_runtime = core.GAsyncRuntime('standalone')
+else:
+    print('starting GRIP graphql service in asgi mode...')
+    grip_runtime = core.GAsyncRuntime('server')
+
+grip_runtime = core.setup(grip_runtime)
+service_registry = grip_runtime.config.get('services')
+forwarder = grip_runtime.config.get('forwarder')
+
+bindables = []
+{% if project.query_specs|length -%}bindables.append(r.query){%- endif %}
+{%+ if project.mutation_specs|length %}bindables.append(r.mutation){% endif %}
+{% for typename in project.object_types %}
+bindables.append(ObjectType('{{ typename }}'))
+{%- endfor %}
+{% for typename in project.batch_types %}
+bindables.append(r.{{ typename }}_type)
+{%- endfor %}
+schema = core.load_executable_schema('{{ project.schema_file }}', bindables, grip_runtime.config['grip_config'])
+executor = core.create_query_executor(grip_runtime, schema)
+json_encoder = gripjson.create_json_encoder(grip_runtime.config['grip_config']['globals'])
+
+
+async def playground(request):
+    return HTMLResponse(PLAYGROUND_HTML)
+
+
+{% if project.metrics -%}
+async def metrics(request):
+    return Response(gripmetrics.REGISTRY.render(), media_type=gripmetrics.CONTENT_TYPE)
+
+
+{% endif -%}
+async def graphql_server(request):
+    data = await request.json()
+    new_context = lambda: core.GRequestContext(request, forwarder, service_registry)
+
+    if isinstance(data, list):
+        success, result = await executor.execute_batch_async(data, new_context)
+    else:
+        success, result = await executor.execute_async(data, new_context())
+
+    status_code = 200 if success else 400
+    body = json_encoder.encode_body(result)
+    if isinstance(body, bytes):
+        return Response(body, status_code=status_code, media_type='application/json')
+    return StreamingResponse(body, status_code=status_code, media_type='application/json')
+
+
+app = Starlette(debug=grip_runtime.debug,
+                routes=[
+                    Route('/graphql', playground, methods=['GET']),
+                    Route('/graphql', graphql_server, methods=['POST']),
+{%- if project.metrics %}
+                    Route('/metrics', metrics, methods=['GET'])
+{%- endif %}
+                ])
+
+
+if __name__ == '__main__':
+    gripserver.run(app, grip_runtime.config['grip_config']['globals'], asgi=True,
+                   after_fork=service_registry.after_fork)
 
 """
\ No newline at end of file
@@ -0,0 +1,114 @@
+#!/usr/bin/env python
+
+import os, sys
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from gripcache import SingleFlight, FlightAborted
+
+
+def run_on_own_loop(coro, outcomes: dict, name: str):
+    # each thread runs its own event loop, as WSGI request threads do
+    loop = asyncio.new_event_loop()
+    try:
+        outcomes[name] = loop.run_until_complete(coro)
+    except BaseException as err:
+        outcomes[name] = err
+    finally:
+        loop.close()
+
+
+def coalesce_across_loops(leader_func) -> tuple:
+    '''Runs a leader and a follower for one key, each on its own thread and event loop;
+    the follower joins while the leader's call is still running.
+    '''
+    single_flight = SingleFlight()
+    follower_joined = threading.Event()
+    calls = []
+
+    async def call():
+        calls.append(threading.current_thread().name)
+        while not follower_joined.is_set():
+            await asyncio.sleep(0.01)
+        return await leader_func()
+
+    async def follow():
+        while single_flight.executions == 0:
+            await asyncio.sleep(0.01)
+        task = asyncio.ensure_future(single_flight.do_async('k', call))
+        await asyncio.sleep(0)
+        follower_joined.set()
+        return await task
+
+    outcomes = {}
+    threads = [threading.Thread(target=run_on_own_loop, args=(single_flight.do_async('k', call), outcomes, 'leader')),
+               threading.Thread(target=run_on_own_loop, args=(follow(), outcomes, 'follower'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    return (single_flight, calls, outcomes)
+
+
+def test_do_async_shares_result_across_event_loops():
+    async def answer():
+        return 42
+
+    single_flight, calls, outcomes = coalesce_across_loops(answer)
+
+    assert outcomes == {'leader': 42, 'follower': 42}
+    assert len(calls) == 1
+    assert single_flight.executions == 1
+    assert single_flight.coalesced == 1
+    assert single_flight.stats['in_flight'] == 0
+
+
+def test_do_async_shares_exception_across_event_loops():
+    async def fail():
+        raise ValueError('no answer')
+
+    single_flight, calls, outcomes = coalesce_across_loops(fail)
+
+    assert isinstance(outcomes['leader'], ValueError)
+    assert outcomes['follower'] is outcomes['leader']
+    assert len(calls) == 1
+
+
+def test_do_async_wakes_followers_when_leader_is_cancelled():
+    async def cancelled():
+        raise asyncio.CancelledError()
+
+    single_flight, calls, outcomes = coalesce_across_loops(cancelled)
+
+    assert isinstance(outcomes['leader'], asyncio.CancelledError)
+    assert isinstance(outcomes['follower'], FlightAborted)
+    assert single_flight.stats['in_flight'] == 0
+
+
+def test_do_shares_result_across_threads():
+    single_flight = SingleFlight()
+    release = threading.Event()
+    results = []
+
+    def slow_answer():
+        release.wait(timeout=5)
+        return 42
+
+    def call():
+        results.append(single_flight.do('k', slow_answer))
+
+    threads = [threading.Thread(target=call) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    while single_flight.executions + single_flight.coalesced < 4:
+        pass
+    release.set()
+    for thread in threads:
+        thread.join(timeout=5)
+
+    assert results == [42] * 4
+    assert single_flight.executions == 1
+    assert single_flight.coalesced == 3
@@ -1,14 +1,19 @@
 #!/usr/bin/env python
 
 import os, sys
+import csv
 import copy
 import base64
+import logging
 from snap import common
+import griptrace
 from vfy_services import PostgresPsycopgService
 from vfy_services import PostgreSQLService
 from sqlalchemy_utils import UUIDType
 
 
+logger = logging.getLogger(__name__)
+
 
 def get_kb_database_svc(service_object_registry):
     secret_mgr = service_object_registry.lookup('secrets')
@@ -23,7 +28,8 @@ def get_kb_database_svc(service_object_registry):
     connection_params['user'] = credentials.pop('username')
     #return PostgresPsycopgService(**connection_params)
 
-    return PostgreSQLService(**connection_params)
+    # built once per set of credentials, and rebuilt only when the secret rotates
+    return service_object_registry.keyed_service('kb_database', PostgreSQLService, **connection_params)
 
 
 def lookup_kb_test_verification(def_id, cursor, schema):
@@ -45,7 +51,7 @@ def lookup_kb_test_verification(def_id, cursor, schema):
 
     query = lookup_query_template.format(schema=schema)
     
-    print(f'>>>____________Fetching record with foreign key {def_id}...')
+    logger.debug('fetching verification records with foreign key %s' % def_id)
 
     try:
         cursor.execute(query, {'odid': def_id})
@@ -62,30 +68,27 @@ def helloathena_func(input_data, service_registry, **kwargs):
     encoded_input_query = input_data['input_query']
 
     input_query = base64.b64decode(encoded_input_query).decode('utf-8')
-    s3_output_filename = athenasvc.athena_to_s3(input_query, 8)
+    with griptrace.handler_span(kwargs, 'athena query'):
+        s3_output_filename = athenasvc.athena_to_s3(input_query, 8)
 
     if not s3_output_filename:
         return 'No result from query.'
 
     s3_svc = service_registry.lookup('s3')
-    querydata = s3_svc.download_data(s3_output_filename)
 
-    # This is CSV data, so the first line will be the header
-    if querydata.find('\n') > -1:
-        query_output_header = querydata.split('\n')[0]
-    else:
-        query_output_header = querydata
-    
-    query_response_fields = [token.strip('"') for token in query_output_header.split(',')]
+    # This is CSV data, so the first line will be the header; we need nothing past it
+    with griptrace.handler_span(kwargs, 's3 read header'):
+        query_output_header = s3_svc.read_header(s3_output_filename)
+    query_response_fields = next(csv.reader([query_output_header]), [])
 
     # query the knowledgebase to get the fields in the test definition    
     
     definition_fields = {}
     obs_def_id = input_data['observation_def_id']
 
-    with db_service.txn_scope() as session:
+    with db_service.txn_scope() as session, griptrace.handler_span(kwargs, 'knowledgebase lookup'):
 
-        print(f'########  OBSERVATION DEF ID: {obs_def_id}')
+        logger.debug('looking up verification fields for observation definition %s' % obs_def_id)
         ObservationVerification = db_service.Base.classes.issue_mgmt_observationverification
         verification_query = session.query(ObservationVerification).filter(ObservationVerification.observation_definition_id == obs_def_id)
         results = verification_query.all()
@@ -93,7 +96,7 @@ def helloathena_func(input_data, service_registry, **kwargs):
         for record in results:
             definition_fields[record.key_name] = record.data_type
  
-        print(common.jsonpretty(definition_fields))
+        logger.debug('definition fields: %s', definition_fields)
         
     errors = []
     for fieldname in query_response_fields:
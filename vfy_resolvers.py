@@ -21,7 +21,7 @@ def resolve_helloathena(obj: Any, info: GraphQLResolveInfo, **kwargs):
     forwarder = grip_context.forwarder
 
     handler_func = forwarder.lookup_query_handler('helloathena')
-    return handler_func(kwargs, service_registry)
+    return handler_func(kwargs, service_registry, request_context=grip_context)
 
 
 @query.field("ping")
@@ -33,7 +33,19 @@ def resolve_ping(obj: Any, info: GraphQLResolveInfo, **kwargs):
     forwarder = grip_context.forwarder
 
     handler_func = forwarder.lookup_query_handler('ping')
-    return handler_func(kwargs, service_registry)
+    return handler_func(kwargs, service_registry, request_context=grip_context)
+
+
+@query.field("jobStatus")
+def resolve_jobStatus(obj: Any, info: GraphQLResolveInfo, **kwargs):
+    grip_context = info.context # GRequestContext object
+
+    request = grip_context.request
+    service_registry = grip_context.service_registry
+    forwarder = grip_context.forwarder
+
+    handler_func = forwarder.lookup_query_handler('jobStatus')
+    return handler_func(kwargs, service_registry, request_context=grip_context)
 
 
 
@@ -45,6 +57,6 @@ def resolve_mutx(obj: Any, info: GraphQLResolveInfo, **kwargs):
     service_registry = grip_context.service_registry
     forwarder = grip_context.forwarder
 
-    handler_func = forwarder.lookup_query_handler('mutx')
-    return handler_func(kwargs, service_registry)
+    handler_func = forwarder.lookup_mutation_handler('mutx')
+    return handler_func(kwargs, service_registry, request_context=grip_context)
 
@@ -2,13 +2,26 @@
 
 import os, sys
 import re
+import copy
+import pickle
+import hashlib
+import tempfile
+import csv
 import json
+import codecs
+import fcntl
 import logging
 
 from contextlib import contextmanager
 import time
+import asyncio
+import threading
+from concurrent.futures import Future
+from concurrent.futures import TimeoutError as FutureTimeoutError
 
 from snap import common
+from gripcache import TTLCache, SingleFlight
+from gripmetrics import SERVICE_LATENCY, SERVICE_BYTES
 import sqlalchemy as sqla
 from sqlalchemy.ext.automap import automap_base
 from sqlalchemy import Column, ForeignKey, Integer, String
@@ -19,6 +32,7 @@ from sqlalchemy import create_engine
 from sqlalchemy import MetaData
 from sqlalchemy_utils import UUIDType
 import boto3
+from botocore.exceptions import ClientError
 import psycopg2
 
 
@@ -26,30 +40,397 @@ logging.basicConfig(level=logging.CRITICAL)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
 
+class CachedSecret(object):
+    def __init__(self, value, expires_at: float, refresh_at: float):
+        self.value = value
+        self.expires_at = expires_at
+        self.refresh_at = refresh_at
+        self.refreshing = False
+
+
+class SecretCache(object):
+    '''Process-wide cache of secret values. A secret is fetched once and then served from
+    memory until it expires; once it is within its refresh margin of expiry, the next read
+    kicks off a background refresh, so callers almost never wait on Secrets Manager.
+    '''
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self.refreshes = 0
+        self.refresh_errors = 0
+        # fetches actually made; coalesced misses share one
+        self.executions = 0
+        self.total_fetch_time = 0.0
+        self.max_fetch_time = 0.0
+        self._entries = {}
+        self._lock = threading.Lock()
+        self._fetches = SingleFlight()
+
+    def get(self, key, fetch, ttl: float, refresh_margin: float):
+        now = self.clock()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now < entry.expires_at:
+                self.hits += 1
+                if now >= entry.refresh_at and not entry.refreshing:
+                    entry.refreshing = True
+                    threading.Thread(target=self._refresh,
+                                     args=(key, fetch, ttl, refresh_margin),
+                                     name='secret-refresh',
+                                     daemon=True).start()
+                return entry.value
+
+            self.misses += 1
+
+        # concurrent misses on one secret share a single fetch
+        return self._fetches.do(key, self._fetch, key, fetch, ttl, refresh_margin)
+
+    def _fetch(self, key, fetch, ttl: float, refresh_margin: float):
+        start_time = self.clock()
+        value = fetch()
+        fetch_time = self.clock() - start_time
+
+        now = self.clock()
+        with self._lock:
+            self.executions += 1
+            self.total_fetch_time += fetch_time
+            self.max_fetch_time = max(self.max_fetch_time, fetch_time)
+            self._entries[key] = CachedSecret(value, now + ttl, now + max(ttl - refresh_margin, 0))
+
+        return value
+
+    def _refresh(self, key, fetch, ttl: float, refresh_margin: float):
+        try:
+            self._fetch(key, fetch, ttl, refresh_margin)
+            with self._lock:
+                self.refreshes += 1
+        except Exception as err:
+            # keep serving the current value; the next read past refresh_at will try again
+            logger.warning('background refresh of secret failed: %s' % err)
+            with self._lock:
+                self.refresh_errors += 1
+                entry = self._entries.get(key)
+                if entry is not None:
+                    entry.refreshing = False
+
+    def invalidate(self, key=None):
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'size': len(self._entries),
+            'hits': self.hits,
+            'misses': self.misses,
+            'refreshes': self.refreshes,
+            'refresh_errors': self.refresh_errors,
+            'executions': self.executions,
+            'avg_fetch_seconds': self.total_fetch_time / self.executions if self.executions else 0.0,
+            'max_fetch_seconds': self.max_fetch_time
+        }
+
+
+SECRET_CACHE = SecretCache()
+
+DEFAULT_SECRET_TTL = 300
+DEFAULT_SECRET_REFRESH_MARGIN = 60
+
+
 class SimpleAWSSecretService(object):
     def __init__(self, **kwargs):
 
         if not kwargs.get('aws_region'):
             raise Exception('"aws_region" is a required keyword argument for SimpleAWSSecretService.')
 
-        region = kwargs['aws_region']
-        profile = kwargs.get('profile', 'default')
+        self.region = kwargs['aws_region']
+        self.profile = kwargs.get('profile', 'default')
+        self.ttl = float(kwargs.get('secret_ttl') or DEFAULT_SECRET_TTL)
+        self.refresh_margin = float(kwargs.get('secret_refresh_margin') or DEFAULT_SECRET_REFRESH_MARGIN)
+        self._asm_client = None
+        self._client_lock = threading.Lock()
 
-        if profile == 'default':
-            logger.debug('creating boto3 session with no profile spec...')
-            b3session = boto3.session.Session()
-        else:
-            logger.debug('creating boto3 session with profile "%s"...' % profile)
-            b3session = boto3.session.Session(profile_name=profile)
 
-        self.asm_client = b3session.client('secretsmanager', region_name=region)
+    @property
+    def asm_client(self):
+        # built on first fetch; a cache hit never needs a boto3 session
+        with self._client_lock:
+            if self._asm_client is None:
+                if self.profile == 'default':
+                    logger.debug('creating boto3 session with no profile spec...')
+                    b3session = boto3.session.Session()
+                else:
+                    logger.debug('creating boto3 session with profile "%s"...' % self.profile)
+                    b3session = boto3.session.Session(profile_name=self.profile)
 
+                self._asm_client = b3session.client('secretsmanager', region_name=self.region)
 
-    def get_secret(self, secret_name):
+        return self._asm_client
+
+
+    def fetch_secret(self, secret_name):
         secret_value = self.asm_client.get_secret_value(SecretId=secret_name)
         return json.loads(secret_value['SecretString'])
 
 
+    @property
+    def stats(self) -> dict:
+        return SECRET_CACHE.stats
+
+    def get_secret(self, secret_name):
+        secret = SECRET_CACHE.get((self.region, self.profile, secret_name),
+                                  lambda: self.fetch_secret(secret_name),
+                                  self.ttl,
+                                  self.refresh_margin)
+
+        # callers are free to modify what they get back
+        return copy.deepcopy(secret)
+
+
+class AthenaQueryFailed(Exception):
+    def __init__(self, execution_id, state, reason=None):
+        super().__init__(f'Athena query execution {execution_id} ended in state {state}: {reason}')
+        self.execution_id = execution_id
+        self.state = state
+        self.reason = reason
+
+
+class AthenaExecution(object):
+    def __init__(self, execution_id: str, poll_interval: float, clock):
+        self.execution_id = execution_id
+        self.future = Future()
+        self.poll_interval = poll_interval
+        self.started_at = clock()
+        self.next_poll_at = self.started_at + poll_interval
+
+
+def chain_future(source: Future, transform) -> Future:
+    target = Future()
+
+    def on_done(completed: Future):
+        if completed.cancelled():
+            target.cancel()
+        elif completed.exception() is not None:
+            target.set_exception(completed.exception())
+        else:
+            try:
+                target.set_result(transform(completed.result()))
+            except Exception as err:
+                target.set_exception(err)
+
+    source.add_done_callback(on_done)
+    return target
+
+
+class AthenaExecutionEngine(object):
+    '''Tracks any number of running Athena query executions from a single poller thread.
+    Each round polls every execution that is due with one batch_get_query_execution call;
+    each execution's poll interval starts short and backs off exponentially, so fast
+    queries complete quickly without hammering the API for slow ones.
+
+    The client is anything with the boto3 Athena batch_get_query_execution() signature.
+    '''
+    MAX_BATCH_SIZE = 50
+    TERMINAL_FAILURE_STATES = ['FAILED', 'CANCELLED']
+
+    def __init__(self,
+                 client,
+                 initial_poll_interval: float=0.1,
+                 max_poll_interval: float=2.0,
+                 backoff_factor: float=1.5,
+                 clock=time.monotonic):
+
+        self.client = client
+        self.initial_poll_interval = initial_poll_interval
+        self.max_poll_interval = max_poll_interval
+        self.backoff_factor = backoff_factor
+        self.clock = clock
+        self.executions = {}
+        self.poll_rounds = 0
+        self._condition = threading.Condition()
+        self._poller = None
+
+    def track(self, execution_id: str) -> Future:
+        '''Returns a Future which resolves to the execution's QueryExecution record on success,
+        or raises AthenaQueryFailed.
+        '''
+        execution = AthenaExecution(execution_id, self.initial_poll_interval, self.clock)
+        with self._condition:
+            self.executions[execution_id] = execution
+            # the poller exits when idle, and is never inherited by a forked worker
+            if self._poller is None or not self._poller.is_alive():
+                self._poller = threading.Thread(target=self._poll_loop, name='athena-poller', daemon=True)
+                self._poller.start()
+            self._condition.notify()
+
+        return execution.future
+
+    def untrack(self, execution_id: str) -> bool:
+        '''Stops polling an execution and cancels its Future. Returns False if the
+        execution had already finished (or was never tracked).
+        '''
+        with self._condition:
+            execution = self.executions.pop(execution_id, None)
+
+        if execution is None:
+            return False
+        execution.future.cancel()
+        return True
+
+    def _poll_loop(self):
+        while True:
+            with self._condition:
+                if not self.executions:
+                    self._poller = None
+                    return
+
+                now = self.clock()
+                next_poll_at = min(ex.next_poll_at for ex in self.executions.values())
+                if next_poll_at > now:
+                    self._condition.wait(next_poll_at - now)
+                    continue
+
+                # executions due shortly are polled early, so that they share this round's call
+                horizon = now + self.initial_poll_interval / 2
+                due = [ex for ex in self.executions.values() if ex.next_poll_at <= horizon]
+                due = due[0:self.MAX_BATCH_SIZE]
+
+            self._poll(due)
+
+    def _poll(self, due: list):
+        self.poll_rounds += 1
+        try:
+            with SERVICE_LATENCY.time('athena', 'poll'):
+                response = self.client.batch_get_query_execution(QueryExecutionIds=[ex.execution_id for ex in due])
+        except Exception as err:
+            logger.warning('Athena status poll failed, will retry: %s' % err)
+            self._reschedule(due)
+            return
+
+        # an execution is resolved by whoever removes it from executions: here, or untrack()
+        finished = []
+        with self._condition:
+            for query_execution in response.get('QueryExecutions', []):
+                if query_execution.get('Status', {}).get('State') in ['SUCCEEDED'] + self.TERMINAL_FAILURE_STATES:
+                    execution = self.executions.pop(query_execution['QueryExecutionId'], None)
+                    if execution is not None:
+                        finished.append((execution, query_execution))
+
+        for execution, query_execution in finished:
+            status = query_execution['Status']
+            if status['State'] == 'SUCCEEDED':
+                execution.future.set_result(query_execution)
+            else:
+                execution.future.set_exception(AthenaQueryFailed(execution.execution_id,
+                                                                 status['State'],
+                                                                 status.get('StateChangeReason')))
+            logger.debug('Athena execution %s finished after %.3fs' % (execution.execution_id,
+                                                                      self.clock() - execution.started_at))
+
+        finished_ids = set(execution.execution_id for execution, query_execution in finished)
+        self._reschedule([ex for ex in due if ex.execution_id not in finished_ids])
+
+    def _reschedule(self, executions: list):
+        now = self.clock()
+        with self._condition:
+            for execution in executions:
+                execution.poll_interval = min(execution.poll_interval * self.backoff_factor, self.max_poll_interval)
+                execution.next_poll_at = now + execution.poll_interval
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'executions_in_flight': len(self.executions),
+            'poll_rounds': self.poll_rounds
+        }
+
+
+SQL_TOKEN_RX = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|((?:\s|--[^\n]*|/\*.*?\*/)+)""", re.DOTALL)
+
+
+def normalize_sql(query: str) -> str:
+    '''Drops comments, collapses whitespace and strips trailing semicolons, leaving
+    quoted literals and identifiers untouched.
+    '''
+    def replace_token(match):
+        if match.group(1):
+            return match.group(1)
+        return ' '
+
+    return SQL_TOKEN_RX.sub(replace_token, query).strip().rstrip(';').strip()
+
+
+class AthenaResultCache(object):
+    '''Remembers the S3 result location of recent successful queries, keyed on their
+    normalized SQL, database and workgroup. Entries are optionally mirrored to a local
+    JSON file so that they outlive the worker process; writers take an flock on a .lock
+    file beside it, so workers merge their entries rather than overwrite each other's.
+    '''
+    def __init__(self, max_age: float, max_entries: int=256, cache_file: str=None):
+        self.max_age = max_age
+        self.cache_file = cache_file
+        # wall-clock time, since entries are read back by later processes
+        self.cache = TTLCache(max_entries, max_age, clock=time.time)
+        self._file_lock = threading.Lock()
+        if cache_file:
+            self._load()
+
+    @staticmethod
+    def make_key(query: str, database: str, workgroup: str=None) -> str:
+        key_source = '\0'.join([database, workgroup or '', normalize_sql(query)])
+        return hashlib.sha256(key_source.encode('utf-8')).hexdigest()
+
+    def _read_file(self) -> dict:
+        try:
+            with open(self.cache_file) as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def _load(self):
+        now = time.time()
+        for key, (created_at, s3_path) in self._read_file().items():
+            remaining = self.max_age - (now - created_at)
+            if remaining > 0:
+                self.cache.put(key, s3_path, ttl=remaining)
+
+    def get(self, key: str):
+        return self.cache.get(key)
+
+    def put(self, key: str, s3_path: str):
+        self.cache.put(key, s3_path)
+        if not self.cache_file:
+            return
+
+        # the query has already succeeded; failing to mirror its result must not fail the request
+        tmp_path = None
+        try:
+            # the thread lock serializes this worker, the lock file the other worker processes,
+            # so the read-merge-write below never drops entries another writer just added
+            with self._file_lock, open(self.cache_file + '.lock', 'a') as lock_file:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+                now = time.time()
+                entries = {k: v for k, v in self._read_file().items() if now - v[0] < self.max_age}
+                entries[key] = [now, s3_path]
+                cache_dir = os.path.dirname(os.path.abspath(self.cache_file))
+                fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'w') as f:
+                    json.dump(entries, f)
+                os.replace(tmp_path, self.cache_file)
+        except Exception as err:
+            logger.warning('could not write Athena result cache %s: %s' % (self.cache_file, err))
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    @property
+    def stats(self) -> dict:
+        return self.cache.stats
+
+
 class AWSAthenaQueryService(object):
     def __init__(self, **kwargs):
         
@@ -61,60 +442,151 @@ class AWSAthenaQueryService(object):
 
         profile = kwargs.get('aws_profile')
         if profile:
-            print('creating boto3 session with profile "%s"...' % profile, file=sys.stderr)
+            logger.info('creating boto3 session with profile "%s"...' % profile)
             self.session = boto3.session.Session(profile_name=profile)
         else:
             # for example, if we get access via AssumeRole
             self.session = boto3.session.Session()
 
-        self.client = self.session.client('athena', region_name=self.region)
+        # a prebuilt client (such as a local stub) may be passed in place of a boto3 client
+        self.client = kwargs.get('athena_client') or self.session.client('athena', region_name=self.region)
+        self.engine = AthenaExecutionEngine(self.client,
+                                            initial_poll_interval=float(kwargs.get('poll_interval') or 0.1),
+                                            max_poll_interval=float(kwargs.get('max_poll_interval') or 2.0))
+
+        self.workgroup = kwargs.get('workgroup')
+        # Athena's own reuse of recent results (requires engine version 3)
+        self.result_reuse_minutes = kwargs.get('athena_result_reuse_minutes')
+
+        self.result_cache = None
+        if kwargs.get('result_cache_max_age'):
+            self.result_cache = AthenaResultCache(float(kwargs['result_cache_max_age']),
+                                                  int(kwargs.get('result_cache_size') or 256),
+                                                  kwargs.get('result_cache_file'))
 
 
     def _athena_query(self, query: str):
-        response = self.client.start_query_execution(
-            QueryString=query,
-            QueryExecutionContext={
+        execution_params = {
+            'QueryString': query,
+            'QueryExecutionContext': {
                 'Database': self.database
             },
-            ResultConfiguration={
+            'ResultConfiguration': {
                 'OutputLocation': 's3://' + self.output_path
             }
-        )
+        }
+        if self.workgroup:
+            execution_params['WorkGroup'] = self.workgroup
+        if self.result_reuse_minutes:
+            execution_params['ResultReuseConfiguration'] = {
+                'ResultReuseByAgeConfiguration': {
+                    'Enabled': True,
+                    'MaxAgeInMinutes': int(self.result_reuse_minutes)
+                }
+            }
+
+        with SERVICE_LATENCY.time('athena', 'start_query'):
+            response = self.client.start_query_execution(**execution_params)
 
-        print(f'###____________initial exec response: {response}')
+        logger.debug('Athena query execution %s started' % response['QueryExecutionId'])
         return response
 
 
-    def athena_to_s3(self, query, max_execution=7):
-        
+    def _result_path(self, query_execution: dict) -> str:
+        s3_path = query_execution['ResultConfiguration']['OutputLocation']
+        filename = re.findall('.*\/(.*)', s3_path)[0]
+        return self.output_path.rstrip('/') + '/' + filename
+
+
+    def start_query(self, query: str) -> Future:
+        '''Starts a query and returns a Future for the S3 path ("bucket/key") of its results.
+        Blocking callers can wait on the Future; async callers can await
+        asyncio.wrap_future() of it.
+        '''
+        return self._start_query(query)[1]
+
+
+    def _start_query(self, query: str) -> tuple:
+        # returns (execution id, Future); the id is None when the result came from the cache
+        cache_key = None
+        if self.result_cache:
+            cache_key = AthenaResultCache.make_key(query, self.database, self.workgroup)
+            s3_result_path = self.result_cache.get(cache_key)
+            if s3_result_path:
+                cached_result = Future()
+                cached_result.set_result(s3_result_path)
+                return (None, cached_result)
+
+        start_time = time.perf_counter()
         execution = self._athena_query(query)
-        execution_id = execution['QueryExecutionId']
-        state = 'RUNNING'
-
-        print(f'### Query state: {state}')
-        while (max_execution > 0 and state in ['RUNNING', 'QUEUED']):
-            max_execution = max_execution - 1
-            response = self.client.get_query_execution(QueryExecutionId = execution_id)
-            print('### Query response:')
-            print(response)
-
-            if 'QueryExecution' in response and \
-                    'Status' in response['QueryExecution'] and \
-                    'State' in response['QueryExecution']['Status']:
-                state = response['QueryExecution']['Status']['State']
-                if state == 'FAILED':
-                    print('### Athena query failed.')
-                    return False
-                elif state == 'SUCCEEDED':
-                    print('### Athena query succeeded.')
-                    s3_path = response['QueryExecution']['ResultConfiguration']['OutputLocation']
-                    filename = re.findall('.*\/(.*)', s3_path)[0]
-
-                    s3_result_path = self.output_path.rstrip('/') + '/' + filename 
-                    return s3_result_path
-            time.sleep(2)
-        
-        return False
+        result = chain_future(self.engine.track(execution['QueryExecutionId']), self._result_path)
+        # time from submission until Athena reports the query finished (or failed)
+        result.add_done_callback(lambda completed: SERVICE_LATENCY.observe(time.perf_counter() - start_time,
+                                                                           'athena',
+                                                                           'wait'))
+
+        if cache_key:
+            def cache_result_path(completed: Future):
+                if not completed.cancelled() and completed.exception() is None:
+                    self.result_cache.put(cache_key, completed.result())
+            result.add_done_callback(cache_result_path)
+
+        return (execution['QueryExecutionId'], result)
+
+
+    def cancel_query(self, execution_id: str):
+        '''Stops waiting for an execution and asks Athena to stop running it.
+        '''
+        self.engine.untrack(execution_id)
+        try:
+            with SERVICE_LATENCY.time('athena', 'stop_query'):
+                self.client.stop_query_execution(QueryExecutionId=execution_id)
+        except Exception as err:
+            logger.warning('Unable to stop Athena query execution %s: %s' % (execution_id, err))
+
+
+    @property
+    def stats(self) -> dict:
+        stats = dict(self.engine.stats)
+        if self.result_cache:
+            stats.update({f'result_cache_{key}': value for key, value in self.result_cache.stats.items()})
+        return stats
+
+
+    def athena_to_s3(self, query, max_execution=7):
+        # max_execution counted 2-second polls in the original fixed-interval loop
+        timeout = max_execution * 2
+        execution_id, result = self._start_query(query)
+        try:
+            return result.result(timeout=timeout)
+        except AthenaQueryFailed as err:
+            logger.error(str(err))
+            return False
+        except FutureTimeoutError:
+            logger.error('Athena query did not finish within %s seconds; stopping it.' % timeout)
+            self.cancel_query(execution_id)
+            return False
+
+
+    async def athena_to_s3_async(self, query, max_execution=7):
+        '''Awaitable counterpart of athena_to_s3, with the same timeout and return values.
+        '''
+        timeout = max_execution * 2
+        execution_id, result = self._start_query(query)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(result), timeout)
+        except AthenaQueryFailed as err:
+            logger.error(str(err))
+            return False
+        except asyncio.TimeoutError:
+            logger.error('Athena query did not finish within %s seconds; stopping it.' % timeout)
+            # stop_query_execution blocks, so it is left to the default executor
+            await asyncio.get_event_loop().run_in_executor(None, self.cancel_query, execution_id)
+            return False
+        except asyncio.CancelledError:
+            if execution_id is not None:
+                asyncio.get_event_loop().run_in_executor(None, self.cancel_query, execution_id)
+            raise
 
 
 PSYCOPG_SVC_PARAM_NAMES = [
@@ -125,6 +597,215 @@ PSYCOPG_SVC_PARAM_NAMES = [
     'port'
 ]
 
+
+class PoolExhausted(Exception):
+    def __init__(self, max_size, timeout):
+        super().__init__(f'All {max_size} pooled connections are in use (waited {timeout}s).')
+
+
+class NoLock(object):
+    # stands in for a Condition in the single-threaded, per-worker pool
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        return False
+
+    def wait(self, timeout=None):
+        return False
+
+    def notify(self):
+        pass
+
+
+class PsycopgConnectionPool(object):
+    '''Bounded pool of psycopg2 connections. Checkout waits up to checkout_timeout for a free
+    connection, discards connections idle for longer than idle_timeout, and (with pre_ping)
+    tests a connection before handing it out.
+
+    The threadsafe pool may be shared by handler threads. The per-worker pool does no locking
+    and never waits, for single-threaded worker processes. Both start over after a fork,
+    so a child process never uses its parent's connections.
+    '''
+    def __init__(self,
+                 connection_params: dict,
+                 min_size: int=1,
+                 max_size: int=10,
+                 checkout_timeout: float=5.0,
+                 idle_timeout: float=300.0,
+                 pre_ping: bool=True,
+                 threadsafe: bool=True):
+
+        self.connection_params = connection_params
+        self.min_size = min_size
+        self.max_size = max_size
+        self.checkout_timeout = checkout_timeout
+        self.idle_timeout = idle_timeout
+        self.pre_ping = pre_ping
+        self.threadsafe = threadsafe
+
+        self.checkouts = 0
+        self.timeouts = 0
+        self.discarded = 0
+        self.total_wait_time = 0.0
+        self.max_wait_time = 0.0
+        self._condition = threading.Condition() if threadsafe else NoLock()
+        self._reset()
+
+    def _reset(self):
+        self._pid = os.getpid()
+        self._idle = []
+        self._size = 0
+        self._prefilled = False
+
+    def _connect(self):
+        return psycopg2.connect(**self.connection_params)
+
+    def _close(self, connection):
+        self.discarded += 1
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _is_usable(self, connection, last_used: float) -> bool:
+        if connection.closed:
+            return False
+        if self.idle_timeout and time.monotonic() - last_used > self.idle_timeout and self._size > self.min_size:
+            return False
+        if self.pre_ping:
+            try:
+                with connection.cursor() as cursor:
+                    cursor.execute('SELECT 1')
+                connection.rollback()
+            except psycopg2.Error:
+                return False
+        return True
+
+    def _prefill(self):
+        with self._condition:
+            if self._pid != os.getpid():
+                # inherited from the parent process: leave those sockets to the parent
+                self._reset()
+            if self._prefilled:
+                return
+            self._prefilled = True
+            count = max(0, self.min_size - self._size)
+            self._size += count
+
+        # the slots are reserved above; connect outside the lock
+        connected = 0
+        try:
+            for i in range(count):
+                connection = self._connect()
+                with self._condition:
+                    self._idle.append((connection, time.monotonic()))
+                    self._condition.notify()
+                connected += 1
+        finally:
+            if connected < count:
+                with self._condition:
+                    self._size -= count - connected
+                    self._prefilled = False
+                    self._condition.notify()
+
+    def _reserve(self, start_time: float):
+        # called with the lock held: pops an idle connection, or reserves a slot for a new
+        # one and returns (None, None)
+        while True:
+            if self._idle:
+                return self._idle.pop()
+
+            if self._size < self.max_size:
+                self._size += 1
+                return (None, None)
+
+            remaining = self.checkout_timeout - (time.monotonic() - start_time)
+            if not self.threadsafe or remaining <= 0:
+                self.timeouts += 1
+                raise PoolExhausted(self.max_size, self.checkout_timeout)
+            self._condition.wait(remaining)
+
+    def checkout(self):
+        start_time = time.monotonic()
+        if not self._prefilled or self._pid != os.getpid():
+            self._prefill()
+
+        while True:
+            with self._condition:
+                connection, last_used = self._reserve(start_time)
+
+            # pinging and connecting happen outside the lock, so that other threads can
+            # check connections out and in meanwhile
+            if connection is None:
+                try:
+                    connection = self._connect()
+                except Exception:
+                    with self._condition:
+                        self._size -= 1
+                        self._condition.notify()
+                    raise
+
+            elif not self._is_usable(connection, last_used):
+                with self._condition:
+                    self._size -= 1
+                    self._close(connection)
+                    self._condition.notify()
+                continue
+
+            with self._condition:
+                return self._checked_out(connection, start_time)
+
+    def _checked_out(self, connection, start_time: float):
+        wait_time = time.monotonic() - start_time
+        self.checkouts += 1
+        self.total_wait_time += wait_time
+        self.max_wait_time = max(self.max_wait_time, wait_time)
+        return connection
+
+    def checkin(self, connection, discard: bool=False):
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+
+            if not discard and not connection.closed:
+                try:
+                    if connection.status != psycopg2.extensions.STATUS_READY:
+                        connection.rollback()
+                    self._idle.append((connection, time.monotonic()))
+                    self._condition.notify()
+                    return
+                except psycopg2.Error:
+                    pass
+
+            self._size -= 1
+            self._close(connection)
+            self._condition.notify()
+
+    def close_idle(self):
+        with self._condition:
+            if self._pid != os.getpid():
+                return
+            while self._idle:
+                connection, last_used = self._idle.pop()
+                self._size -= 1
+                self._close(connection)
+
+    @property
+    def stats(self) -> dict:
+        return {
+            'size': self._size,
+            'in_use': self._size - len(self._idle),
+            'idle': len(self._idle),
+            'max_size': self.max_size,
+            'checkouts': self.checkouts,
+            'timeouts': self.timeouts,
+            'discarded': self.discarded,
+            'avg_wait_seconds': self.total_wait_time / self.checkouts if self.checkouts else 0.0,
+            'max_wait_seconds': self.max_wait_time
+        }
+
+
 class PostgresPsycopgService(object):
     def __init__(self, **kwargs):
         raw_params = kwargs
@@ -134,25 +815,95 @@ class PostgresPsycopgService(object):
             self.db_connection_params[name] = raw_params[name]
         self.db_connection_params['connect_timeout'] = 3
 
+        # pool_mode is "threaded" (shared by handler threads), "worker" (one unlocked pool
+        # per single-threaded worker process), or unset for a new connection per use
+        self.pool = None
+        pool_mode = kwargs.get('pool_mode')
+        if pool_mode:
+            if pool_mode not in ['threaded', 'worker']:
+                raise Exception(f'Unsupported pool_mode "{pool_mode}". Valid modes are "threaded" and "worker".')
+
+            self.pool = PsycopgConnectionPool(self.db_connection_params,
+                                              min_size=int(kwargs.get('pool_min_size') or 1),
+                                              max_size=int(kwargs.get('pool_max_size') or 10),
+                                              checkout_timeout=float(kwargs.get('pool_checkout_timeout') or 5),
+                                              idle_timeout=float(kwargs.get('pool_idle_timeout') or 300),
+                                              pre_ping=kwargs.get('pool_pre_ping', True) not in [None, False, 'false', 'False'],
+                                              threadsafe=(pool_mode == 'threaded'))
+
 
     def open_connection(self):
-        return psycopg2.connect(**self.db_connection_params)
+        # pooled connections must be handed back with release_connection()
+        with SERVICE_LATENCY.time('postgres_psycopg', 'checkout'):
+            if self.pool:
+                return self.pool.checkout()
+            return psycopg2.connect(**self.db_connection_params)
+
+
+    def release_connection(self, connection, discard: bool=False):
+        if self.pool:
+            self.pool.checkin(connection, discard)
+        else:
+            connection.close()
+
+
+    @property
+    def stats(self) -> dict:
+        return self.pool.stats if self.pool else {}
+
+
+    def dispose(self):
+        if self.pool:
+            self.pool.close_idle()
 
 
     @contextmanager
     def connect(self):
         connection = None
+        broken = False
         try:
-            connection = psycopg2.connect(**self.db_connection_params)
+            connection = self.open_connection()
             yield connection
             connection.commit()
         except:
             if connection is not None:
-                connection.rollback()
+                try:
+                    connection.rollback()
+                except psycopg2.Error:
+                    broken = True
             raise
         finally:
             if connection is not None:
-                connection.close()
+                self.release_connection(connection, discard=broken)
+
+
+def parse_table_list(tables) -> list:
+    # YAML init params may give the table list either as a list or as a comma-separated string
+    if not tables:
+        return []
+    if isinstance(tables, str):
+        tables = tables.split(',')
+    return [table.strip() for table in tables if table.strip()]
+
+
+def instrument_engine(engine, service_name: str):
+    '''Records the time of every statement the engine executes.
+    '''
+    @sqla.event.listens_for(engine, 'before_cursor_execute')
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault('grip_query_start', []).append(time.perf_counter())
+
+    @sqla.event.listens_for(engine, 'after_cursor_execute')
+    def stop_timer(conn, cursor, statement, parameters, context, executemany):
+        start_time = conn.info['grip_query_start'].pop()
+        SERVICE_LATENCY.observe(time.perf_counter() - start_time, service_name, 'query')
+
+    @sqla.event.listens_for(engine, 'handle_error')
+    def discard_timer(exception_context):
+        # a failed statement gets no after_cursor_execute
+        starts = exception_context.connection.info.get('grip_query_start') if exception_context.connection else None
+        if starts:
+            SERVICE_LATENCY.observe(time.perf_counter() - starts.pop(), service_name, 'query')
 
 
 POSTGRESQL_SVC_PARAM_NAMES = [
@@ -195,12 +946,18 @@ class PostgreSQLService(object):
             init_params['password'] = kwargs['password']        
 
         self.schema = kwargs.get('schema', 'public')
+        self.host = init_params['host']
+        self.port = init_params['port']
         self.metadata = None
         self.engine = None
         self.session_factory = None
         self.Base = None
         self.url = None
 
+        # reflecting only the tables the handlers use keeps startup fast on large schemas
+        self.reflect_tables = parse_table_list(kwargs.get('reflect_tables'))
+        self.reflection_cache_file = kwargs.get('reflection_cache_file')
+
         url_template = '{db_type}://{user}:{password}@{host}:{port}/{dbname}'
         db_url = url_template.format(**init_params)
         
@@ -209,23 +966,19 @@ class PostgreSQLService(object):
         while not connected and retries < 3:
             try:
                 self.engine = sqla.create_engine(db_url, echo=False)
-                self.metadata = MetaData(schema=self.schema)
-                self.Base = automap_base(bind=self.engine, metadata=self.metadata)
-                self.Base.prepare(self.engine, reflect=True)
-                self.metadata.reflect(bind=self.engine)
+                instrument_engine(self.engine, 'postgres')
+                self.metadata = self._load_metadata()
+                self.Base = automap_base(metadata=self.metadata)
+                self.Base.prepare()
                 self.session_factory = sessionmaker(bind=self.engine, autoflush=False, autocommit=False)
-
-                # this is required. See comment in SimpleRedshiftService 
-                connection = self.engine.connect()                
-                connection.close()
                 connected = True
-                print('### Connected to PostgreSQL DB.', file=sys.stderr)
+                logger.info('connected to PostgreSQL db on host %s' % self.host)
                 self.url = db_url
 
             except Exception as err:
-                print(err, file=sys.stderr)
-                print(err.__class__.__name__, file=sys.stderr)
-                print(err.__dict__, file=sys.stderr)
+                logger.warning('PostgreSQL connection attempt %d failed (%s): %s' % (retries + 1,
+                                                                                      err.__class__.__name__,
+                                                                                      err))
                 time.sleep(1)
                 retries += 1
             
@@ -233,6 +986,94 @@ class PostgreSQLService(object):
             raise Exception('!!! Unable to connect to PostgreSQL db on host %s at port %s.' % 
                             (self.host, self.port))
 
+    def _fingerprinted_schemas(self, connection) -> list:
+        # reflection follows foreign keys, possibly into other schemas; collect every schema
+        # reachable from this one that way
+        referenced_schema_query = sqla.text("""
+            SELECT DISTINCT target_ns.nspname
+            FROM pg_constraint fk
+            JOIN pg_class source ON source.oid = fk.conrelid
+            JOIN pg_namespace source_ns ON source_ns.oid = source.relnamespace
+            JOIN pg_class target ON target.oid = fk.confrelid
+            JOIN pg_namespace target_ns ON target_ns.oid = target.relnamespace
+            WHERE fk.contype = 'f' AND source_ns.nspname = ANY(:schemas)
+        """)
+
+        schemas = {self.schema}
+        while True:
+            referenced = {row[0] for row in connection.execute(referenced_schema_query, {'schemas': sorted(schemas)})}
+            if referenced <= schemas:
+                return sorted(schemas)
+            schemas |= referenced
+
+    def _schema_fingerprint(self, connection) -> str:
+        '''Covers every table of the schema (and of any schema its foreign keys lead to)
+        rather than just reflect_tables, since reflecting those also loads the tables they
+        reference.
+        '''
+        fingerprint_query = sqla.text("""
+            SELECT table_schema, table_name, column_name, data_type, is_nullable, column_default, ordinal_position
+            FROM information_schema.columns
+            WHERE table_schema = ANY(:schemas)
+            ORDER BY table_schema, table_name, ordinal_position
+        """)
+        constraint_query = sqla.text("""
+            SELECT table_schema, table_name, constraint_name, constraint_type
+            FROM information_schema.table_constraints
+            WHERE table_schema = ANY(:schemas)
+            ORDER BY table_schema, table_name, constraint_name
+        """)
+
+        schemas = self._fingerprinted_schemas(connection)
+        fingerprint = hashlib.sha256(sqla.__version__.encode('utf-8'))
+        fingerprint.update(repr(self.reflect_tables).encode('utf-8'))
+        for query in [fingerprint_query, constraint_query]:
+            for row in connection.execute(query, {'schemas': schemas}):
+                fingerprint.update(repr(tuple(row)).encode('utf-8'))
+
+        return fingerprint.hexdigest()
+
+
+    def _load_metadata(self) -> MetaData:
+        '''Reflects the schema (or just reflect_tables, plus the tables they reference) once.
+        With a reflection_cache_file, the reflected metadata is pickled and reused for as long
+        as the schema fingerprint in information_schema is unchanged.
+        '''
+        with self.engine.connect() as connection:
+            fingerprint = None
+            if self.reflection_cache_file:
+                fingerprint = self._schema_fingerprint(connection)
+                try:
+                    with open(self.reflection_cache_file, 'rb') as f:
+                        cached = pickle.load(f)
+                    if cached['fingerprint'] == fingerprint:
+                        logger.info('loaded reflected schema from %s' % self.reflection_cache_file)
+                        return cached['metadata']
+                except FileNotFoundError:
+                    pass
+                except Exception as err:
+                    logger.warning('ignoring unreadable reflection cache %s: %s' % (self.reflection_cache_file, err))
+
+            metadata = MetaData(schema=self.schema)
+            metadata.reflect(bind=connection, only=self.reflect_tables or None)
+
+        if fingerprint:
+            # the cache only speeds up the next start; failing to write it must not fail this one
+            tmp_path = None
+            try:
+                cache_dir = os.path.dirname(os.path.abspath(self.reflection_cache_file))
+                fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+                with os.fdopen(fd, 'wb') as f:
+                    pickle.dump({'fingerprint': fingerprint, 'metadata': metadata}, f)
+                os.replace(tmp_path, self.reflection_cache_file)
+            except Exception as err:
+                logger.warning('could not write reflection cache %s: %s' % (self.reflection_cache_file, err))
+                if tmp_path is not None and os.path.exists(tmp_path):
+                    os.remove(tmp_path)
+
+        return metadata
+
+
     @contextmanager
     def txn_scope(self):
         session = self.session_factory()
@@ -246,6 +1087,18 @@ class PostgreSQLService(object):
             session.close()
 
 
+    def dispose(self):
+        # closes pooled connections; any still checked out are closed when they are returned
+        if self.engine is not None:
+            self.engine.dispose()
+
+
+    def after_fork(self):
+        # replaces the pool inherited from the parent without closing the parent's connections
+        if self.engine is not None:
+            self.engine.dispose(close=False)
+
+
     @contextmanager    
     def connect(self):
         connection = self.engine.connect()
@@ -256,6 +1109,11 @@ class PostgreSQLService(object):
 
 
 
+DEFAULT_S3_CHUNK_SIZE = 256 * 1024
+DEFAULT_S3_HEADER_PROBE_SIZE = 1024
+MAX_S3_HEADER_SIZE = 1024 * 1024
+
+
 class S3Service(object):
     def __init__(self, **kwargs):
                 
@@ -264,22 +1122,106 @@ class S3Service(object):
         
         profile = kwargs.get('aws_profile')
         if profile:
-            print('creating boto3 session with profile "%s"...' % profile, file=sys.stderr)
+            logger.info('creating boto3 session with profile "%s"...' % profile)
             self.session = boto3.session.Session(profile_name=profile)
         else:
             # for example, if we get access via AssumeRole
             self.session = boto3.session.Session()
 
         self.s3client = boto3.client('s3', region_name=self.region)
+        self.chunk_size = int(kwargs.get('chunk_size') or DEFAULT_S3_CHUNK_SIZE)
  
 
-    def download_data(self, s3path):
-
+    def _split_path(self, s3path):
         separator_index = s3path.find('/')
         bucket_name = s3path[0:separator_index]
         object_key = s3path[separator_index:].strip('/')
+        return (bucket_name, object_key)
+
+
+    def download_data(self, s3path):
+
+        bucket_name, object_key = self._split_path(s3path)
+
+        logger.debug('calling get_object() with bucket %s and key %s' % (bucket_name, object_key))
+
+        with SERVICE_LATENCY.time('s3', 'download_data'):
+            obj = self.s3client.get_object(Bucket=bucket_name, Key=object_key)
+            data = obj['Body'].read()
+
+        SERVICE_BYTES.inc(len(data), 's3', 'download_data')
+        return data.decode('utf-8')
+
+
+    def get_range(self, s3path, start: int, end: int=None) -> bytes:
+        '''Fetches bytes start..end (inclusive) of an object; with no end, reads to the end of the object.
+        '''
+        bucket_name, object_key = self._split_path(s3path)
+        byte_range = f'bytes={start}-{end}' if end is not None else f'bytes={start}-'
+        with SERVICE_LATENCY.time('s3', 'get_range'):
+            try:
+                obj = self.s3client.get_object(Bucket=bucket_name, Key=object_key, Range=byte_range)
+            except ClientError as err:
+                # S3 rejects any range starting past the end of the object, including on empty objects
+                if err.response.get('Error', {}).get('Code') == 'InvalidRange':
+                    return b''
+                raise
+
+            data = obj['Body'].read()
+
+        SERVICE_BYTES.inc(len(data), 's3', 'get_range')
+        return data
+
+
+    def iter_chunks(self, s3path, chunk_size: int=None):
+        bucket_name, object_key = self._split_path(s3path)
+        # time to first byte; the rest is paced by the consumer
+        with SERVICE_LATENCY.time('s3', 'iter_chunks'):
+            obj = self.s3client.get_object(Bucket=bucket_name, Key=object_key)
+        body = obj['Body']
+        try:
+            for chunk in body.iter_chunks(chunk_size or self.chunk_size):
+                SERVICE_BYTES.inc(len(chunk), 's3', 'iter_chunks')
+                yield chunk
+        finally:
+            body.close()
+
+
+    def iter_lines(self, s3path, chunk_size: int=None):
+        '''Yields the object's text one line at a time (line endings included), holding at most
+        one chunk plus one partial line in memory.
+        '''
+        decoder = codecs.getincrementaldecoder('utf-8')()
+        remainder = ''
+        for chunk in self.iter_chunks(s3path, chunk_size):
+            lines = (remainder + decoder.decode(chunk)).split('\n')
+            remainder = lines.pop()
+            for line in lines:
+                yield line + '\n'
+
+        remainder += decoder.decode(b'', final=True)
+        if remainder:
+            yield remainder
+
+
+    def iter_csv_rows(self, s3path, chunk_size: int=None):
+        return csv.reader(self.iter_lines(s3path, chunk_size))
+
 
-        print(f'###__________Calling get_object() with bucket: {bucket_name} and key: {object_key}')
+    def read_header(self, s3path, probe_size: int=DEFAULT_S3_HEADER_PROBE_SIZE) -> str:
+        '''Returns the first line of an object (without its line ending), fetching only the
+        leading bytes of the object rather than all of it.
+        '''
+        data = b''
+        while True:
+            data = self.get_range(s3path, 0, probe_size - 1)
+            newline_index = data.find(b'\n')
+            if newline_index > -1:
+                data = data[0:newline_index]
+                break
+            # a short read means we already have the whole object
+            if len(data) < probe_size or probe_size >= MAX_S3_HEADER_SIZE:
+                break
+            probe_size *= 4
 
-        obj = self.s3client.get_object(Bucket=bucket_name, Key=object_key)
-        return obj['Body'].read().decode('utf-8')
+        return data.decode('utf-8', errors='replace').rstrip('\r')